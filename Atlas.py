@@ -0,0 +1,92 @@
+import pygame
+import Cache
+
+# a row of rects of at most height pixels, filled from left to right
+class Shelf:
+    def __init__(self, y, height):
+        self.y = y
+        self.height = height
+        self.x = 0
+
+# places rects on shelves, a new shelf is opened below the last one when no shelf has room
+class Page:
+    def __init__(self, size, padding=1):
+        self.size = size
+        self.padding = padding
+        self.shelves = []
+        self.usedHeight = 0
+        self.usedArea = 0
+        self.surface = None
+    def insert(self, size):
+        # top left of a free rect of size, None if the page is full
+        width = size[0] + self.padding
+        height = size[1] + self.padding
+        for shelf in self.shelves:
+            if height <= shelf.height and shelf.x + width <= self.size[0]:
+                return self.place(shelf, size, width)
+        if self.usedHeight + height > self.size[1] or width > self.size[0]:
+            return None
+        shelf = Shelf(self.usedHeight, height)
+        self.shelves.append(shelf)
+        self.usedHeight += height
+        return self.place(shelf, size, width)
+    def place(self, shelf, size, width):
+        pos = (shelf.x, shelf.y)
+        shelf.x += width
+        self.usedArea += size[0] * size[1]
+        return pos
+    def createSurface(self):
+        # pages are cut to the height actually used
+        surface = pygame.Surface((self.size[0], max(self.usedHeight, 1)), pygame.SRCALPHA)
+        if Cache.hasDisplay():
+            surface = surface.convert_alpha()
+        surface.fill((0, 0, 0, 0))
+        self.surface = surface
+        return surface
+    def getFill(self):
+        return self.usedArea / max(self.size[0] * self.usedHeight, 1)
+
+# packs many small surfaces into a few large pages, the pieces are subsurfaces of the pages
+class Atlas:
+    def __init__(self, pageSize=1024, padding=1):
+        self.pageSize = pageSize
+        self.padding = padding
+        self.pages = []
+    def insert(self, size):
+        # returns the page and the top left of the rect reserved for size
+        for page in self.pages:
+            pos = page.insert(size)
+            if pos is not None:
+                return page, pos
+        # layers larger than a page get a page of their own
+        pageSize = (max(self.pageSize, size[0] + self.padding), max(self.pageSize, size[1] + self.padding))
+        page = Page(pageSize, self.padding)
+        self.pages.append(page)
+        return page, page.insert(size)
+    def pack(self, sizes):
+        # placements for a list of sizes, taller ones first so the shelves waste less space
+        order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+        placements = [None] * len(sizes)
+        for i in order:
+            placements[i] = self.insert(sizes[i])
+        return placements
+    def getMemory(self):
+        return sum(page.surface.get_width() * page.surface.get_height() * 4 for page in self.pages if page.surface)
+    def __repr__(self):
+        fill = ", ".join(format(page.getFill(), ".0%") for page in self.pages)
+        return "Atlas(" + str(len(self.pages)) + " pages, fill " + fill + ")"
+
+def packLayers(layers, pageSize=1024, padding=1):
+    # copy the pixels of the visible layers into atlas pages, the layers then hand out subsurfaces of them
+    layers = [layer for layer in layers if layer.visible]
+    atlas = Atlas(pageSize, padding)
+    sizes = [layer.getPixelSize() for layer in layers]
+    placements = atlas.pack(sizes)
+    for page in atlas.pages:
+        page.createSurface()
+    for layer, size, (page, pos) in zip(layers, sizes, placements):
+        rect = pygame.Rect(pos, size)
+        # max blending onto the cleared page copies the pixels without premultiplying them
+        page.surface.blit(layer.getSurface(), rect, pygame.Rect((0, 0), size), pygame.BLEND_RGBA_MAX)
+        layer.setAtlas(page.surface.subsurface(rect))
+    return atlas
@@ -0,0 +1,212 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pygame
+import main
+import Cache
+import PsdLoader
+try:
+    import resource
+except ImportError:
+    resource = None
+from vector import Vector
+
+# synthetic scenes, each takes a size and a number of keyframes per track
+
+def circleScene(count, keys):
+    for i in range(count):
+        c = main.Circle((i % 512, i // 512), 5)
+        main.objects.append(c)
+        for k in range(keys):
+            frame = k * main.TimeLine._instance.frameCount // max(keys - 1, 1)
+            c.addKeyFrame(frame, "pos", Vector((i * 7 + k * 31) % 512, (i * 13 + k * 17) % 512))
+            c.addKeyFrame(frame, "radius", 2 + (i + k) % 10)
+
+def surfScene(count, keys):
+    # a chain of surfs, every one the child of the one before
+    parent = None
+    for i in range(count):
+        surf = pygame.Surface((40, 12), pygame.SRCALPHA)
+        surf.fill((255, 255 * i // max(count, 1), 0, 255))
+        if parent is None:
+            shape = main.Surf((256, 256), surf)
+            main.objects.append(shape)
+        else:
+            shape = main.Surf(parent.pos + Vector(20, 0), surf)
+            parent.addChild(shape)
+        for k in range(keys):
+            frame = k * main.TimeLine._instance.frameCount // max(keys - 1, 1)
+            shape.addKeyFrame(frame, "angle", (-1) ** k * (10 + i % 20))
+        parent = shape
+
+scenes = {
+    "circles": circleScene,
+    "surfs": surfScene,
+}
+
+def loadSynthetic(scene, count, keys):
+    main.scenes["benchmark"] = lambda: scenes[scene](count, keys)
+    main.loadScene("benchmark")
+
+def timeIt(function, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        function(i)
+    return (time.perf_counter() - start) / repeat
+
+def benchScene(scene, count, keys, frames):
+    loadSynthetic(scene, count, keys)
+    shapes = list(main.walkShapes(main.objects))
+    frameCount = main.TimeLine._instance.frameCount
+    results = {}
+
+    def evaluateKeyframes(i):
+        for shape in shapes:
+            shape.evaluateKeyframes(i % frameCount)
+    results["evaluateKeyframes"] = timeIt(evaluateKeyframes, frames)
+
+    def keyframeInterpolate(i):
+        for shape in shapes:
+            currentKeys = shape.evaluateKeyframes(i % frameCount)
+            for low, high in currentKeys.values():
+                shape.keyframeInterpolate(low, high, i % frameCount)
+    results["keyframeInterpolate"] = timeIt(keyframeInterpolate, frames)
+
+    results["evaluate"] = timeIt(lambda i: main.evaluate(main.objects, i % frameCount), frames)
+
+    def draw(i):
+        main.applyTransforms(main.evaluate(main.objects, i % frameCount))
+        main.artBoard.fill((0, 0, 0, 0))
+        main.artBoard.blits(main.getDisplayList(main.objects), doreturn=False)
+    results["draw"] = timeIt(draw, frames)
+
+    with tempfile.TemporaryDirectory() as path:
+        main.TimeLine._instance.frameCount = frames
+        start = time.perf_counter()
+        main.Renderer().renderPNGSequance(path, "bench")
+        results["renderPNGSequance"] = (time.perf_counter() - start) / frames
+        main.TimeLine._instance.frameCount = frameCount
+    results["fps"] = 1 / results["renderPNGSequance"]
+    return results
+
+def benchPsd(path):
+    # load time of a psd file, without and with the disk cache
+    results = {}
+    cacheDir = PsdLoader.cacheDir
+    with tempfile.TemporaryDirectory() as tmp:
+        PsdLoader.cacheDir = None
+        start = time.perf_counter()
+        PsdLoader.loadToLayers(path)
+        results["loadToLayers"] = time.perf_counter() - start
+        PsdLoader.cacheDir = tmp
+        PsdLoader.loadToLayers(path)
+        start = time.perf_counter()
+        PsdLoader.loadToLayers(path)
+        results["loadToLayersCached"] = time.perf_counter() - start
+    PsdLoader.cacheDir = cacheDir
+    return results
+
+memoryNames = ("residentMemory", "surfaceMemory")
+
+def residentMemory():
+    # resident memory of the process in bytes, the peak where only getrusage has it, None on windows
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # on linux a spawned process would inherit the peak of its parent, there statm is read instead
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def surfaceMemory(scene):
+    # bytes of pixels held by the caches and the surfaces and buffers of the shapes, which python tracing does not see
+    total = Cache.rotozoomCache.size + Cache.frameCache.size + Cache.circleCache.size
+    for shape in main.walkShapes(scene):
+        if isinstance(shape, main.Surf):
+            surfaces = {id(surf): surf for surf in (shape.orgSurf, shape.surf) if surf is not None}
+            total += sum(Cache.surfaceBytes(surf) for surf in surfaces.values())
+            if shape.layer is not None and shape.layer.buffer is not None:
+                total += len(shape.layer.buffer)
+    return total
+
+def measureMemory(scene, count, keys):
+    # growth of the process memory from building the scene and drawing one frame,
+    # run in a fresh process so neither other cases nor the timings are counted
+    before = residentMemory()
+    loadSynthetic(scene, count, keys)
+    main.Renderer().drawFrame(0)
+    after = residentMemory()
+    return {"residentMemory": after - before if before is not None else None, "surfaceMemory": surfaceMemory(main.objects)}
+
+def run(cases, frames, psd=None):
+    report = {}
+    for scene, count, keys in cases:
+        results = benchScene(scene, count, keys, frames)
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results.update(pool.submit(measureMemory, scene, count, keys).result())
+        report[scene + "-" + str(count) + "x" + str(keys)] = results
+    if psd:
+        report["psd"] = benchPsd(psd)
+    return report
+
+def compare(report, baseline, threshold):
+    # timings and memory that grew over the baseline by more than threshold, fps is compared the other way
+    regressions = []
+    for case, results in report.items():
+        for name, value in results.items():
+            old = baseline.get(case, {}).get(name)
+            if not old or value is None:
+                continue
+            ratio = old / value if name == "fps" else value / old
+            if ratio > 1 + threshold:
+                regressions.append((case, name, old, value))
+    return regressions
+
+def printReport(report):
+    for case, results in report.items():
+        print(case)
+        for name, value in results.items():
+            if name in memoryNames:
+                if value is None:
+                    print("    %-20s %10s" % (name, "n/a"))
+                else:
+                    print("    %-20s %10.1f MB" % (name, value / (1024 * 1024)))
+            elif name == "fps":
+                print("    %-20s %10.1f" % (name, value))
+            else:
+                print("    %-20s %10.3f ms" % (name, value * 1000))
+
+def parseArgs():
+    parser = argparse.ArgumentParser(description="benchmark scene evaluation and rendering")
+    parser.add_argument("--count", type=int, default=200, help="shapes per synthetic scene")
+    parser.add_argument("--keys", type=int, default=20, help="keyframes per track")
+    parser.add_argument("--frames", type=int, default=50, help="frames timed per measurement")
+    parser.add_argument("--psd", help="also time loading this psd file")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parseArgs()
+    cases = [(scene, args.count, args.keys) for scene in scenes.keys()]
+    report = run(cases, args.frames, args.psd)
+    printReport(report)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=4)
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for case, name, old, value in regressions:
+            print("regression in " + case + " " + name + ": " + str(old) + " -> " + str(value))
+        if regressions:
+            raise SystemExit(1)
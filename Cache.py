@@ -0,0 +1,101 @@
+from collections import OrderedDict
+import pygame
+
+def surfaceBytes(surf):
+    return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+def hasDisplay():
+    # surfaces are converted to the display format only when there is a display, headless renders have none
+    return pygame.display.get_init() and pygame.display.get_surface() is not None
+
+# least recently used cache limited by the total size of its entries
+class LRUCache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    def put(self, key, value, size):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+        if size > self.budget:
+            return
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.size > self.budget:
+            _, (_, oldSize) = self.entries.popitem(last=False)
+            self.size -= oldSize
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+    def __len__(self):
+        return len(self.entries)
+
+# rotated and scaled copies of surfaces, angles within tolerance degrees share one entry
+class RotozoomCache(LRUCache):
+    def __init__(self, budget=64 * 1024 * 1024, tolerance=0.1):
+        super().__init__(budget)
+        self.tolerance = tolerance
+    def quantize(self, angle):
+        if self.tolerance <= 0:
+            return angle
+        return round((angle % 360) / self.tolerance) * self.tolerance % 360
+    def rotozoom(self, surf, angle, scale=1.0):
+        angle = self.quantize(angle)
+        key = (id(surf), angle, scale)
+        entry = self.get(key)
+        # the source is kept in the entry so a reused id of a freed surface is not mistaken for it
+        if entry is not None and entry[0] is surf:
+            return entry[1]
+        result = pygame.transform.rotozoom(surf, angle, scale)
+        self.put(key, (surf, result), surfaceBytes(result))
+        return result
+    def discard(self, surf):
+        # drop every rotation of surf so its pixels can be freed
+        for key in [key for key, (entry, size) in self.entries.items() if entry[0] is surf]:
+            self.size -= self.entries.pop(key)[1]
+
+# rendered artBoard frames for the ram preview, dropped as a whole when the scene revision changes
+class FrameCache(LRUCache):
+    def __init__(self, budget=256 * 1024 * 1024):
+        super().__init__(budget)
+        self.revision = None
+    def validate(self, revision):
+        if revision != self.revision:
+            self.clear()
+            self.revision = revision
+    def lookup(self, frame, revision):
+        self.validate(revision)
+        return self.get(frame)
+    def store(self, frame, revision, surface):
+        self.validate(revision)
+        self.put(frame, surface.copy(), surfaceBytes(surface))
+
+# filled circles drawn once per color and radius, so circles are blitted like any other surface
+class CircleCache(LRUCache):
+    def __init__(self, budget=16 * 1024 * 1024):
+        super().__init__(budget)
+    def circle(self, color, radius):
+        # pygame.draw.circle truncates the radius, a circle drawn centered at (radius, radius) matches it pixel for pixel
+        radius = int(radius)
+        key = (color, radius)
+        surf = self.get(key)
+        if surf is None:
+            surf = pygame.Surface((radius * 2 + 1, radius * 2 + 1), pygame.SRCALPHA)
+            surf.fill((0, 0, 0, 0))
+            pygame.draw.circle(surf, color, (radius, radius), radius)
+            self.put(key, surf, surfaceBytes(surf))
+        return surf
+
+rotozoomCache = RotozoomCache()
+frameCache = FrameCache()
+circleCache = CircleCache()
@@ -0,0 +1,111 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+from PIL import Image
+
+# frames are handed to a background thread through a bounded queue, write blocks while the queue is full
+class StreamWriter:
+    def __init__(self, size, fps, queueSize=8):
+        self.size = size
+        self.fps = fps
+        self.frames = 0
+        self.error = None
+        self.queue = queue.Queue(queueSize)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    def write(self, surface):
+        if self.error:
+            raise self.error
+        # copy the pixels now, the render loop reuses the surface for the next frame
+        self.queue.put(pygame.image.tobytes(surface, "RGBA"))
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error:
+                continue
+            try:
+                self.writeFrame(data)
+                self.frames += 1
+            except Exception as e:
+                self.error = e
+    def writeFrame(self, data):
+        pass
+    def finish(self):
+        pass
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.finish()
+        if self.error:
+            raise self.error
+
+# pipes raw frames into an ffmpeg process which encodes them
+class FfmpegWriter(StreamWriter):
+    codecArgs = ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+    def __init__(self, path, size, fps, queueSize=8, codecArgs=None, ffmpeg="ffmpeg"):
+        args = [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+                "-s", str(size[0]) + "x" + str(size[1]), "-r", str(fps), "-i", "-"]
+        args += codecArgs if codecArgs is not None else FfmpegWriter.codecArgs
+        self.process = subprocess.Popen(args + [path], stdin=subprocess.PIPE)
+        super().__init__(size, fps, queueSize)
+    def writeFrame(self, data):
+        self.process.stdin.write(data)
+    def finish(self):
+        # when ffmpeg exited early the pipe is broken, it is still waited for so its exit code is reported
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0 and (not self.error or isinstance(self.error, BrokenPipeError)):
+            self.error = RuntimeError("ffmpeg exited with code " + str(self.process.returncode))
+
+# uncompressed RGBA frames back to back, with a json file next to it describing the stream
+class RawWriter(StreamWriter):
+    def __init__(self, path, size, fps, queueSize=8):
+        self.path = path
+        self.file = open(path, "wb")
+        super().__init__(size, fps, queueSize)
+    def writeFrame(self, data):
+        self.file.write(data)
+    def finish(self):
+        self.file.close()
+        with open(self.path + ".json", "w") as file:
+            json.dump({"width": self.size[0], "height": self.size[1], "fps": self.fps, "pix_fmt": "rgba", "frames": self.frames}, file)
+
+def openWriter(path, size, fps, queueSize=8):
+    # .rgba files are written raw, anything else is encoded by ffmpeg according to its extension
+    if path.endswith(".rgba"):
+        return RawWriter(path, size, fps, queueSize)
+    return FfmpegWriter(path, size, fps, queueSize)
+
+# compresses and saves png frames on a thread pool while the next frames are rendered
+class AsyncPngWriter:
+    def __init__(self, threads=None, maxInFlight=8, compressLevel=6):
+        self.compressLevel = compressLevel
+        self.pool = ThreadPoolExecutor(threads or os.cpu_count())
+        self.inFlight = threading.Semaphore(maxInFlight)
+        self.errors = []
+    def write(self, surface, path):
+        if self.errors:
+            raise self.errors[0]
+        # wait for a free slot so only maxInFlight frames are held in memory
+        self.inFlight.acquire()
+        data = pygame.image.tobytes(surface, "RGBA")
+        job = self.pool.submit(self.save, data, surface.get_size(), path)
+        job.add_done_callback(self.done)
+    def save(self, data, size, path):
+        Image.frombytes("RGBA", size, data).save(path, compress_level=self.compressLevel)
+    def done(self, job):
+        if job.exception() is not None:
+            self.errors.append(job.exception())
+        self.inFlight.release()
+    def close(self):
+        self.pool.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,217 @@
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+import numpy as np
+from vector import Vector
+
+class KeyValue:
+    def __init__(self, frame, value, slope=1):
+        self.frame = frame
+        self.value = value
+        self.slope = slope
+    def __str__(self):
+        return "KeyValue(" + str(self.frame) + ", " + str(self.value) + ")"
+    def __repr__(self):
+        return self.__str__()
+
+# an editable keyframe track, keys stay sorted by frame and a frame holds at most one key
+class Track:
+    def __init__(self, keys=()):
+        self.keys = []
+        # frame of every key, searched with bisect
+        self.frames = []
+        self.insertMany(keys)
+    def __len__(self):
+        return len(self.keys)
+    def __getitem__(self, index):
+        return self.keys[index]
+    def __iter__(self):
+        return iter(self.keys)
+    def insert(self, key):
+        # a key on a frame that already has one replaces it
+        i = bisect_left(self.frames, key.frame)
+        if i < len(self.frames) and self.frames[i] == key.frame:
+            self.keys[i] = key
+            return
+        self.keys.insert(i, key)
+        self.frames.insert(i, key.frame)
+    def insertMany(self, keys):
+        # merge and sort once, later keys win on the same frame
+        merged = {key.frame: key for key in self.keys}
+        for key in keys:
+            merged[key.frame] = key
+        self.keys = sorted(merged.values(), key=attrgetter("frame"))
+        self.frames = [key.frame for key in self.keys]
+    def getRange(self, start, end):
+        # indices of the keys with start <= frame <= end
+        return bisect_left(self.frames, start), bisect_right(self.frames, end)
+    def remove(self, start, end):
+        lo, hi = self.getRange(start, end)
+        del self.keys[lo:hi]
+        del self.frames[lo:hi]
+        return hi - lo
+    def shift(self, start, end, offset):
+        # move the keys with start <= frame <= end by offset, they replace keys they land on
+        lo, hi = self.getRange(start, end)
+        moved = self.keys[lo:hi]
+        del self.keys[lo:hi]
+        del self.frames[lo:hi]
+        for key in moved:
+            key.frame += offset
+        self.insertMany(moved)
+        return len(moved)
+
+def slopeCurve(t, p0, p1):
+    # y = (p1 -2 +p0)x^3 + (-p1+3-2p0)x^2 +p0x, same curve as Shape.keyframeInterpolate
+    return (p1 - 2 + p0) * t * t * t + (-p1 + 3 - 2 * p0) * t * t + p0 * t
+
+def interpolate(frames, values, slopes, lo, hi, x):
+    # lo and hi are key indices around x, equal when the track holds a single key
+    f0 = frames[lo]
+    f1 = frames[hi]
+    span = f1 - f0
+    t = np.where(span > 0, (x - f0) / np.where(span > 0, span, 1), 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    calculated_t = slopeCurve(t, slopes[lo], slopes[hi])
+    v0 = values[lo]
+    v1 = values[hi]
+    return v0 + (v1 - v0) * calculated_t[:, None]
+
+# a keyframe track stored as arrays of frames, values and slopes,
+# indexing it builds KeyValue objects on demand so it can stand in for a list of keys
+class CompiledTrack:
+    def __init__(self, frames, values, slopes, vector=False):
+        self.frames = np.asarray(frames, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.frames), -1)
+        self.slopes = np.asarray(slopes, dtype=np.float64)
+        self.vector = vector
+    def fromKeys(keys):
+        vector = len(keys) > 0 and isinstance(keys[0].value, Vector)
+        if vector:
+            values = [(k.value.x, k.value.y) for k in keys]
+        else:
+            values = [k.value for k in keys]
+        return CompiledTrack([k.frame for k in keys], values, [k.slope for k in keys], vector)
+    def __len__(self):
+        return len(self.frames)
+    def __getitem__(self, index):
+        return KeyValue(float(self.frames[index]), self.toValue(self.values[index]), float(self.slopes[index]))
+    def __iter__(self):
+        for i in range(len(self.frames)):
+            yield self[i]
+    def evaluate(self, frames):
+        # evaluate the track at every frame in frames, returns an array of shape (len(frames), dims)
+        x = np.atleast_1d(np.asarray(frames, dtype=np.float64))
+        n = len(self.frames)
+        hi = np.clip(np.searchsorted(self.frames, x, side="right"), 1, max(n - 1, 0))
+        lo = np.maximum(hi - 1, 0)
+        return interpolate(self.frames, self.values, self.slopes, lo, hi, x)
+    def toValue(self, row):
+        if self.vector:
+            return Vector(float(row[0]), float(row[1]))
+        return float(row[0])
+    def valueAt(self, frame):
+        return self.toValue(self.evaluate(frame)[0])
+
+def fitSegment(t, y, p0):
+    # slopes of the curve through the normalized samples y at t, p0 is fitted too when it is None
+    # the curve is linear in the slopes: p0 (t^3 - 2t^2 + t) + p1 (t^3 - t^2) + (-2t^3 + 3t^2)
+    g0 = t * t * t - 2 * t * t + t
+    g1 = t * t * t - t * t
+    y = y - (-2 * t * t * t + 3 * t * t)
+    if p0 is None:
+        (p0, p1), *_ = np.linalg.lstsq(np.stack([g0, g1], axis=1), y, rcond=None)
+        return p0, p1
+    denominator = np.dot(g1, g1)
+    if denominator == 0:
+        return p0, 1.0
+    return p0, np.dot(g1, y - p0 * g0) / denominator
+
+def segmentError(x, samples, f0, f1, v0, v1, p0, p1):
+    # largest distance between the samples and the curve from (f0, v0) to (f1, v1)
+    if len(x) == 0:
+        return 0.0
+    t = (x - f0) / (f1 - f0)
+    curve = v0 + (v1 - v0) * slopeCurve(t, p0, p1)[:, None]
+    return np.sqrt(((curve - samples) ** 2).sum(axis=1)).max()
+
+def reduceTrack(track, tolerance):
+    # fewer keys whose curve stays within tolerance of track at every key and every half frame,
+    # keys are dropped greedily, each kept key gets the slope that fits the keys it replaces
+    n = len(track)
+    if n < 3:
+        return track
+    frames = track.frames
+    values = track.values
+    x = np.union1d(frames, np.arange(np.ceil(frames[0]), np.floor(frames[-1]) + 1, 0.5))
+    samples = track.evaluate(x)
+    keep = [0]
+    slopes = [float(track.slopes[0])]
+    # the slope of the start key is free when it does not shape the segment before it
+    free = True
+    a = 0
+    def span(i, j):
+        return np.searchsorted(x, frames[i], side="right"), np.searchsorted(x, frames[j], side="left")
+    while a < n - 1:
+        best = (a + 1, slopes[-1], float(track.slopes[a + 1]), False)
+        for e in range(a + 2, n):
+            lo, hi = span(a, e)
+            d = values[e] - values[a]
+            dd = np.dot(d, d)
+            flat = dd == 0
+            if flat:
+                p0, p1 = slopes[-1], float(track.slopes[e])
+            else:
+                y = (samples[lo:hi] - values[a]) @ d / dd
+                p0, p1 = fitSegment((x[lo:hi] - frames[a]) / (frames[e] - frames[a]), y, None if free else slopes[-1])
+            if segmentError(x[lo:hi], samples[lo:hi], frames[a], frames[e], values[a], values[e], p0, p1) > tolerance:
+                break
+            # only end on e when the original next key can still be reached from it with the fitted slope
+            if e < n - 1:
+                nlo, nhi = span(e, e + 1)
+                if segmentError(x[nlo:nhi], samples[nlo:nhi], frames[e], frames[e + 1], values[e], values[e + 1], p1, track.slopes[e + 1]) > tolerance:
+                    continue
+            best = (e, float(p0), float(p1), flat)
+        e, p0, p1, flat = best
+        slopes[-1] = p0
+        keep.append(e)
+        slopes.append(p1)
+        free = flat
+        a = e
+    return CompiledTrack(frames[keep], values[keep], slopes, track.vector)
+
+# many tracks concatenated so they can all be evaluated at one frame in a single call
+class TrackSet:
+    def __init__(self, tracks):
+        self.tracks = [t for t in tracks if len(t) > 0]
+        self.dims = max([t.values.shape[1] for t in self.tracks], default=1)
+        if len(self.tracks) == 0:
+            return
+        allFrames = np.concatenate([t.frames for t in self.tracks])
+        self.minFrame = allFrames.min()
+        self.maxFrame = allFrames.max()
+        # shift every track into its own block so one sorted array holds all of them
+        self.blockSize = self.maxFrame - self.minFrame + 1
+        lengths = np.array([len(t) for t in self.tracks])
+        self.ends = np.cumsum(lengths)
+        self.starts = self.ends - lengths
+        self.offsets = np.arange(len(self.tracks)) * self.blockSize
+        self.frames = np.concatenate([t.frames for t in self.tracks])
+        self.keyed = self.frames + np.repeat(self.offsets, lengths)
+        self.values = np.zeros((len(self.frames), self.dims))
+        for t, start in zip(self.tracks, self.starts):
+            self.values[start:start + len(t), :t.values.shape[1]] = t.values
+        self.slopes = np.concatenate([t.slopes for t in self.tracks])
+    def __len__(self):
+        return len(self.tracks)
+    def evaluateAt(self, frame):
+        # values of all tracks at frame, one row per track
+        if len(self.tracks) == 0:
+            return np.zeros((0, self.dims))
+        x = np.full(len(self.tracks), min(max(frame, self.minFrame), self.maxFrame), dtype=np.float64)
+        idx = np.searchsorted(self.keyed, x + self.offsets, side="right")
+        hi = np.minimum(np.maximum(idx, self.starts + 1), self.ends - 1)
+        lo = np.maximum(hi - 1, self.starts)
+        return interpolate(self.frames, self.values, self.slopes, lo, hi, x)
+    def valuesAt(self, frame):
+        rows = self.evaluateAt(frame)
+        return [t.toValue(row) for t, row in zip(self.tracks, rows)]
@@ -0,0 +1,102 @@
+import json
+import time
+from collections import deque
+import pygame
+
+# times a block of code and reports it to the profiler
+class Section:
+    def __init__(self, profiler, name, label):
+        self.profiler = profiler
+        self.name = name
+        self.label = label
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.label, self.start, time.perf_counter())
+        return False
+
+class NullSection:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+nullSection = NullSection()
+
+# per frame phase and per object timings of the editor loop and the renderer
+class Profiler:
+    def __init__(self, history=60, maxEvents=500000):
+        self.enabled = False
+        self.history = deque(maxlen=history)
+        self.maxEvents = maxEvents
+        self.events = []
+        self.frame = None
+        self.font = None
+    def section(self, name):
+        if not self.enabled:
+            return nullSection
+        return Section(self, name, None)
+    def measure(self, label, phase):
+        # time spent by one object in a phase
+        if not self.enabled:
+            return nullSection
+        return Section(self, phase, label)
+    def beginFrame(self):
+        if not self.enabled:
+            self.frame = None
+            return
+        self.frame = {"start": time.perf_counter(), "phases": {}, "objects": {}}
+    def endFrame(self):
+        if self.frame is None:
+            return
+        self.frame["total"] = time.perf_counter() - self.frame["start"]
+        self.history.append(self.frame)
+        self.frame = None
+    def record(self, name, label, start, end):
+        duration = end - start
+        if self.frame is not None:
+            if label is None:
+                phases = self.frame["phases"]
+                phases[name] = phases.get(name, 0) + duration
+            else:
+                objects = self.frame["objects"]
+                objects[label] = objects.get(label, 0) + duration
+        if len(self.events) < self.maxEvents:
+            self.events.append({"name": label or name, "cat": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": 0, "tid": 0})
+    def getAverages(self):
+        # average phase and object times over the recent frames, in seconds
+        phases = {}
+        objects = {}
+        total = 0
+        count = max(len(self.history), 1)
+        for frame in self.history:
+            total += frame["total"]
+            for name, duration in frame["phases"].items():
+                phases[name] = phases.get(name, 0) + duration / count
+            for label, duration in frame["objects"].items():
+                objects[label] = objects.get(label, 0) + duration / count
+        return total / count, phases, objects
+    def getLines(self, topObjects=5):
+        total, phases, objects = self.getAverages()
+        lines = ["frame " + format(total * 1000, ".2f") + " ms"]
+        lines.append("  ".join(name + " " + format(duration * 1000, ".2f") for name, duration in phases.items()))
+        for label, duration in sorted(objects.items(), key=lambda x: -x[1])[:topObjects]:
+            lines.append(label + " " + format(duration * 1000, ".2f") + " ms")
+        return lines
+    def getOverlayRect(self, bottomLeft, lineHeight=16, lines=7, width=600):
+        return pygame.Rect(bottomLeft[0], bottomLeft[1] - lineHeight * lines, width, lineHeight * lines)
+    def drawOverlay(self, surface, bottomLeft, lineHeight=16):
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        lines = self.getLines()
+        y = bottomLeft[1] - lineHeight * len(lines)
+        for line in lines:
+            surface.blit(self.font.render(line, True, (200, 200, 200)), (bottomLeft[0], y))
+            y += lineHeight
+    def dump(self, path):
+        # chrome trace event format, opens in chrome://tracing or perfetto
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events}, file)
+
+profiler = Profiler()
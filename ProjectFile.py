@@ -0,0 +1,68 @@
+import json
+import os
+import struct
+import numpy as np
+
+# a json header describing the scene followed by the raw arrays it refers to,
+# the arrays are mapped from the file on load instead of being parsed
+magic = b"ANIMPRJ1"
+extension = ".anim"
+alignment = 16
+
+def align(offset):
+    return (offset + alignment - 1) // alignment * alignment
+
+# collects the arrays of a project while its header is built
+class Writer:
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+    def add(self, array, shape=None):
+        # returns the reference to array that is stored in the header, bytes are stored as uint8 of the given shape
+        if isinstance(array, bytes):
+            array = np.frombuffer(array, dtype=np.uint8)
+        array = np.ascontiguousarray(array)
+        if shape is not None:
+            array = array.reshape(shape)
+        offset = align(self.size)
+        self.arrays.append((offset, array))
+        self.size = offset + array.nbytes
+        return {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+    def write(self, path, header):
+        headerBytes = json.dumps(header).encode("utf-8")
+        dataStart = align(len(magic) + 8 + len(headerBytes))
+        with open(path + ".tmp", "wb") as file:
+            file.write(magic)
+            file.write(struct.pack("<Q", len(headerBytes)))
+            file.write(headerBytes)
+            for offset, array in self.arrays:
+                file.seek(dataStart + offset)
+                file.write(array.tobytes())
+        os.replace(path + ".tmp", path)
+
+# an opened project file, arrays are read only views into the mapped file
+class Reader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(magic)) != magic:
+                raise ValueError(path + " is not a project file")
+            headerSize = struct.unpack("<Q", file.read(8))[0]
+            self.header = json.loads(file.read(headerSize).decode("utf-8"))
+        self.dataStart = align(len(magic) + 8 + headerSize)
+        self.data = np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) > self.dataStart else None
+    def array(self, ref):
+        dtype = np.dtype(ref["dtype"])
+        start = self.dataStart + ref["offset"]
+        count = int(np.prod(ref["shape"], dtype=np.int64))
+        return self.data[start:start + count * dtype.itemsize].view(dtype).reshape(ref["shape"])
+    def resolve(self, path):
+        # paths in the header are relative to the project file
+        return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(self.path)), path))
+
+def relativePath(path, projectPath):
+    try:
+        return os.path.relpath(os.path.abspath(path), os.path.dirname(os.path.abspath(projectPath)))
+    except ValueError:
+        # on another drive
+        return os.path.abspath(path)
@@ -1,19 +1,219 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
 import pygame
 from psd_tools import PSDImage
+import Atlas
+import Cache
+
+# decoded layers are kept here between runs, None disables the cache
+cacheDir = ".psdcache"
+# width and height of the atlas pages visible layers are packed into at load time, None disables the atlas
+atlasPageSize = None
+
+def composeLayer(psdLayer):
+    # psd_tools 1.10 renamed compose to composite
+    if hasattr(psdLayer, "compose"):
+        return psdLayer.compose()
+    return psdLayer.composite()
+
+# pixel copies made while loading layers, compared to the two copies of tobytes and fromstring every layer used to take
+class LoadStats:
+    baselineCopies = 2
+    def __init__(self):
+        self.layers = 0
+        self.bytesCopied = 0
+        self.bytesSaved = 0
+    def add(self, size, copies):
+        layerBytes = size[0] * size[1] * 4
+        self.layers += 1
+        self.bytesCopied += layerBytes * copies
+        # negative when a layer took more copies than before, e.g. a mode conversion
+        self.bytesSaved += layerBytes * (LoadStats.baselineCopies - copies)
+    def __str__(self):
+        return "LoadStats(" + str(self.layers) + " layers, " + str(self.bytesCopied) + " bytes copied, " + str(self.bytesSaved) + " bytes saved)"
+    def __repr__(self):
+        return self.__str__()
+
+loadStats = LoadStats()
+
+def toBytes(image, size):
+    # the RGBA pixels of a composed PIL image and the number of pixel copies made, empty layers become transparent pixels
+    if image is None:
+        size = (max(size[0], 1), max(size[1], 1))
+        return bytes(size[0] * size[1] * 4), size, 1
+    copies = 1
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+        copies += 1
+    return image.tobytes(), image.size, copies
+
+def toSurface(buffer, size):
+    # the surface shares buffer, it is only copied when converting to the display pixel format
+    surface = pygame.image.frombuffer(buffer, size, "RGBA")
+    if Cache.hasDisplay():
+        return surface.convert_alpha(), False
+    return surface, True
+
+def fileHash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def tmpPath(path):
+    # render workers fill the same cache at once, each writes its own temporary file before replacing path
+    return path + "." + str(os.getpid()) + ".tmp"
+
+def getDigest(path):
+    # the hash of a file is remembered with its size and modification time, so an unchanged file is not read again
+    source = os.path.abspath(path)
+    stat = os.stat(source)
+    sourcesPath = os.path.join(cacheDir, "sources.json")
+    sources = {}
+    if os.path.exists(sourcesPath):
+        try:
+            with open(sourcesPath) as file:
+                sources = json.load(file)
+        except ValueError:
+            sources = {}
+    entry = sources.get(source)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["digest"]
+    digest = fileHash(source)
+    sources[source] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "digest": digest}
+    os.makedirs(cacheDir, exist_ok=True)
+    with open(tmpPath(sourcesPath), "w") as file:
+        json.dump(sources, file)
+    os.replace(tmpPath(sourcesPath), sourcesPath)
+    return digest
+
+# a psd file, parsed only when a layer has to be composed
+class Document:
+    def __init__(self, path, cachePath=None):
+        self.path = path
+        self.cachePath = cachePath
+        self.psd = None
+    def getPsd(self):
+        if self.psd is None:
+            self.psd = PSDImage.open(self.path)
+        return self.psd
+    def getPsdLayer(self, index):
+        return list(self.getPsd())[index]
+    def getLayerCachePath(self, index):
+        return os.path.join(self.cachePath, str(index) + ".rgba")
+    def loadCached(self, layer):
+        # map the decoded pixels of a layer from the cache, None if they are not cached yet or the file does not fit the layer
+        if self.cachePath is None or not os.path.exists(self.getLayerCachePath(layer.index)):
+            return None
+        width, height = layer.getPixelSize()
+        if os.path.getsize(self.getLayerCachePath(layer.index)) != width * height * 4:
+            return None
+        with open(self.getLayerCachePath(layer.index), "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    def storeCached(self, layer, buffer):
+        if self.cachePath is None:
+            return
+        target = self.getLayerCachePath(layer.index)
+        with open(tmpPath(target), "wb") as file:
+            file.write(buffer)
+        os.replace(tmpPath(target), target)
+
+# a psd layer whose pixels are only composed when first needed
+class Layer:
+    def __init__(self, document, index, name, visible, bbox):
+        self.document = document
+        self.index = index
+        self.name = name
+        self.visible = visible
+        self.bbox = tuple(bbox)
+        # position as center of bounding box
+        width = self.bbox[2] - self.bbox[0]
+        height = self.bbox[3] - self.bbox[1]
+        self.size = (width, height)
+        self.pos = (self.bbox[0] + width // 2, self.bbox[1] + height // 2)
+        self.surface = None
+        self.buffer = None
+        self.packed = False
+    def getPixelSize(self):
+        return (max(self.size[0], 1), max(self.size[1], 1))
+    def isLoaded(self):
+        return self.surface is not None
+    def getSurface(self):
+        if self.surface is None:
+            buffer = self.document.loadCached(self)
+            size = self.getPixelSize()
+            # a mapped cache file is read in place, without copying it
+            copies = 0
+            if buffer is None:
+                buffer, size, copies = toBytes(composeLayer(self.document.getPsdLayer(self.index)), self.size)
+                self.document.storeCached(self, buffer)
+            self.surface, shared = toSurface(buffer, size)
+            # keep the buffer alive only while the surface still points into it, otherwise it was converted into a copy
+            if shared:
+                self.buffer = buffer
+            else:
+                self.buffer = None
+                copies += 1
+            loadStats.add(size, copies)
+        return self.surface
+    def setAtlas(self, surface):
+        # surface is a piece of an atlas page, the pixels of the layer itself are dropped
+        self.surface = surface
+        self.buffer = None
+        self.packed = True
+    def unload(self):
+        # packed layers stay, their pixels are part of a shared page
+        if self.packed:
+            return
+        self.surface = None
+        self.buffer = None
+    def toDict(self):
+        return {"name": self.name, "visible": self.visible, "bbox": list(self.bbox), "pos": list(self.pos)}
+    def __repr__(self):
+        return "Layer(" + self.name + ", " + str(self.pos) + ")"
+
+def removeStaleCaches(source, keep):
+    # drop caches of older versions of the same source file
+    for entry in os.listdir(cacheDir):
+        indexPath = os.path.join(cacheDir, entry, "index.json")
+        if entry == keep or not os.path.exists(indexPath):
+            continue
+        with open(indexPath) as file:
+            if json.load(file).get("source") == source:
+                shutil.rmtree(os.path.join(cacheDir, entry), ignore_errors=True)
+
+def loadLazy(path):
+    # read the layer metadata only, pixels are composed by Layer.getSurface
+    if cacheDir is None:
+        document = Document(path)
+        return packAtlas([Layer(document, i, l.name, l.visible, l.bbox) for i, l in enumerate(document.getPsd())])
+    digest = getDigest(path)
+    document = Document(path, os.path.join(cacheDir, digest))
+    indexPath = os.path.join(document.cachePath, "index.json")
+    if os.path.exists(indexPath):
+        with open(indexPath) as file:
+            index = json.load(file)
+        return packAtlas([Layer(document, i, l["name"], l["visible"], l["bbox"]) for i, l in enumerate(index["layers"])])
+    layers = [Layer(document, i, l.name, l.visible, l.bbox) for i, l in enumerate(document.getPsd())]
+    os.makedirs(document.cachePath, exist_ok=True)
+    source = os.path.abspath(path)
+    with open(tmpPath(indexPath), "w") as file:
+        json.dump({"source": source, "layers": [l.toDict() for l in layers]}, file)
+    os.replace(tmpPath(indexPath), indexPath)
+    removeStaleCaches(source, digest)
+    return packAtlas(layers)
+
+def packAtlas(layers):
+    if atlasPageSize is not None:
+        Atlas.packLayers(layers, atlasPageSize)
+    return layers
 
 def loadToLayers(path):
-    psd = PSDImage.open(path)
     layers = []
-    for layer in psd:
-        image = layer.compose()
-        # position as center of bounding box
-        width = layer.bbox[2] - layer.bbox[0]
-        height = layer.bbox[3] - layer.bbox[1]
-        x = layer.bbox[0] + width // 2
-        y = layer.bbox[1] + height // 2
-
-        layerPos = (x, y)
-        # convert the image to a pygame surface
-        surface = pygame.image.fromstring(image.tobytes(), image.size, image.mode)
-        layers.append((surface, layerPos))
-    return layers
\ No newline at end of file
+    for layer in loadLazy(path):
+        layers.append((layer.getSurface(), layer.pos))
+    return layers
@@ -0,0 +1,50 @@
+import pygame
+
+# uniform grid over rectangles, items are rehashed only when their rect changes
+class GridIndex:
+    def __init__(self, cellSize=64):
+        self.cellSize = cellSize
+        self.cells = {}
+        self.rects = {}
+        self.itemCells = {}
+    def getCells(self, rect):
+        size = self.cellSize
+        return [(x, y) for x in range(rect.left // size, (rect.right - 1) // size + 1) for y in range(rect.top // size, (rect.bottom - 1) // size + 1)]
+    def update(self, item, rect):
+        if rect is None:
+            self.remove(item)
+            return
+        rect = pygame.Rect(rect)
+        if self.rects.get(item) == rect:
+            return
+        self.remove(item)
+        cells = self.getCells(rect)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(item)
+        self.rects[item] = rect
+        self.itemCells[item] = cells
+    def remove(self, item):
+        if item not in self.rects:
+            return
+        for cell in self.itemCells.pop(item):
+            bucket = self.cells[cell]
+            bucket.discard(item)
+            if not bucket:
+                del self.cells[cell]
+        del self.rects[item]
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
+        self.itemCells.clear()
+    def queryPoint(self, point):
+        # items whose rect contains point
+        cell = (int(point[0]) // self.cellSize, int(point[1]) // self.cellSize)
+        return [item for item in self.cells.get(cell, ()) if self.rects[item].collidepoint(point)]
+    def queryRect(self, rect):
+        rect = pygame.Rect(rect)
+        found = set()
+        for cell in self.getCells(rect):
+            found.update(self.cells.get(cell, ()))
+        return [item for item in found if self.rects[item].colliderect(rect)]
+    def __len__(self):
+        return len(self.rects)
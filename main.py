@@ -1,16 +1,34 @@
 from vector import *
-from math import radians
+from math import radians, sin, cos
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import PsdLoader
+import KeyTrack
+from KeyTrack import KeyValue
+import ProjectFile
+import Cache
+import SpatialIndex
+import matrix
+import Encoder
+from Profiler import profiler
 import pygame
 
 pygame.init()
 
-win = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
+# the window is only created by the editor, headless renders never open one
+win = None
 artBoard = pygame.Surface((512, 512), pygame.SRCALPHA)
-artBoardPos = Vector(win.get_width() // 2 - artBoard.get_width() // 2, win.get_height() // 2 - artBoard.get_height() // 2)
+artBoardPos = Vector()
 clock = pygame.time.Clock()
 fps = 60
 
+def initWindow():
+    global win, artBoardPos
+    win = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
+    artBoardPos = Vector(win.get_width() // 2 - artBoard.get_width() // 2, win.get_height() // 2 - artBoard.get_height() // 2)
+
 keyFrameDiamond = [(2,0),(0,4),(-2,0),(0,-4)]
 
 class Display:
@@ -21,6 +39,9 @@ class Display:
         self.selectedHandle = None
         self.selectedObj = None
         # self.attributes = Attributes()
+        self.drawnTimeLine = None
+        self.drawnHandles = None
+        self.drawnHandleRects = []
     def getInstance():
         return Display._instance
     def handleEvents(self, event):
@@ -32,6 +53,8 @@ class Display:
                     TimeLine._instance.state = TIMELINE_DRAG
             if self.selectedHandle:
                 Handle._state = "drag"
+            elif not TimeLine._instance.selected:
+                self.selectObject(self.pick(event.pos))
         # mouse released
         if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
             # if timeline selected
@@ -47,9 +70,22 @@ class Display:
     def updateHandles(self):
         if self.selectedObj:
             Handle.createHandles(self.selectedObj)
+    def pick(self, pos):
+        # top most shape under a window position
+        point = (pos[0] - artBoardPos[0], pos[1] - artBoardPos[1])
+        hits = [shape for shape in shapeIndex.queryPoint(point) if shape.hitTest(point)]
+        if len(hits) == 0:
+            return None
+        return max(hits, key=lambda shape: shape.zIndex)
+    def selectObject(self, obj):
+        self.selectedObj = obj
+        if obj:
+            Handle.createHandles(obj)
+        else:
+            Handle.clear()
     def step(self):
         self.timeLine.step()
-        for h in Handle._reg:
+        for h in Handle._index.queryPoint(pygame.mouse.get_pos()):
             h.step()
         if self.selectedHandle:
             if Handle._state == "idle":
@@ -58,6 +94,20 @@ class Display:
                     self.selectedHandle = None
             elif Handle._state == "drag":
                 self.selectedHandle.update()
+    def collectDirtyRects(self):
+        # window rects of the ui that changed since the last call
+        rects = []
+        timeLineState = self.timeLine.getDrawState()
+        if timeLineState != self.drawnTimeLine:
+            rects.append(self.timeLine.getRect())
+            self.drawnTimeLine = timeLineState
+        handleState = tuple((h.pos[0], h.pos[1], h.selected) for h in Handle._reg)
+        if handleState != self.drawnHandles:
+            handleRects = [h.getRect() for h in Handle._reg]
+            rects += self.drawnHandleRects + handleRects
+            self.drawnHandles = handleState
+            self.drawnHandleRects = handleRects
+        return rects
     def draw(self):
         self.timeLine.draw()
         for h in Handle._reg:
@@ -75,24 +125,89 @@ class Attributes:
     def draw(self):
         win.blit(self.surf, (win.get_width() - self.surf.get_width(), win.get_height() // 2))
 
-class KeyValue:
-    def __init__(self, frame, value, slope=1):
-        self.frame = frame
-        self.value = value
-        self.slope = slope
+# resolved state of a shape at a single frame, pos and angle are local to the parent
+class Transform:
+    def __init__(self, pos, angle, radius, localMatrix, worldMatrix, worldAngle):
+        self.pos = pos
+        self.angle = angle
+        self.radius = radius
+        self.localMatrix = localMatrix
+        self.worldMatrix = worldMatrix
+        self.worldAngle = worldAngle
+    @property
+    def worldPos(self):
+        return Vector(self.worldMatrix[4], self.worldMatrix[5])
     def __str__(self):
-        return "KeyValue(" + str(self.frame) + ", " + str(self.value) + ")"
+        return "Transform(" + str(self.worldPos) + ", " + str(self.worldAngle) + ")"
     def __repr__(self):
         return self.__str__()
 
 class Shape:
+    _count = 0
+    # bumped whenever keyframes or the hierarchy change
+    _trackRevision = 0
+    # bumped by every edit of the scene, invalidates the ram preview
+    _editRevision = 0
     def __init__(self, pos):
         self.initialize(pos)
     def initialize(self, pos):
+        # cached local and world transforms, recomputed only when the shape or one of its parents changed
+        self.localMatrix = None
+        self.worldMatrix = matrix.identity
+        self.worldAngle = 0
+        self.worldDirty = True
+        Shape._count += 1
+        self.name = type(self).__name__ + str(Shape._count)
         self.pos = vectorCopy(pos)
+        self.angle = 0
         self.keyFrames = {}
+        self.compiledTracks = {}
         self.children = []
         self.parent = None
+        # what was last drawn on the artBoard, used for dirty rectangles
+        self.drawnState = None
+        self.drawnBounds = None
+        self.zIndex = 0
+    # pos and angle are local to the parent, assigning them marks the world transform of the subtree dirty
+    @property
+    def pos(self):
+        return self._pos
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos
+        self.localMatrix = None
+        self.markDirty()
+    @property
+    def angle(self):
+        return self._angle
+    @angle.setter
+    def angle(self, angle):
+        self._angle = angle
+        self.localMatrix = None
+        self.markDirty()
+    def markDirty(self):
+        # a dirty shape always has a dirty subtree, so propagation stops at the first dirty shape
+        if self.worldDirty:
+            return
+        self.worldDirty = True
+        for child in self.children:
+            child.markDirty()
+    def getLocalMatrix(self):
+        if self.localMatrix is None:
+            self.localMatrix = matrix.fromPosAngle(self._pos, self._angle)
+        return self.localMatrix
+    def updateWorld(self):
+        if self.parent == None:
+            self.worldAngle = self._angle
+            self.worldMatrix = self.getLocalMatrix()
+        else:
+            self.worldMatrix = matrix.multiply(self.parent.getWorldMatrix(), self.getLocalMatrix())
+            self.worldAngle = self.parent.worldAngle + self._angle
+        self.worldDirty = False
+    def getWorldMatrix(self):
+        if self.worldDirty:
+            self.updateWorld()
+        return self.worldMatrix
     def move(self, pos, abs=False):
         if abs:
             self.pos = pos
@@ -110,19 +225,76 @@ class Shape:
         posOfChild = child.pos - self.pos
         self.children.append(child)
         child.parent = self
+        child.markDirty()
+        Shape._trackRevision += 1
+        Shape._editRevision += 1
         child.move(posOfChild, abs=True)
     def getSize(self):
         pass
+    def getBounds(self):
+        # artBoard rect painted by this shape alone, None when it paints nothing
+        return None
+    def hitTest(self, point):
+        bounds = self.getBounds()
+        return bounds is not None and bounds.collidepoint(point)
+    def setPosRel(self, vec):
+        self.pos = self.pos + vec
+        Shape._editRevision += 1
+    def getDrawState(self):
+        pos = self.getAbsolutePos()
+        return (pos[0], pos[1], self.getAbsoluteAngle())
+    def getRecord(self, writer, projectPath):
+        # header entry of the shape in a project file, the keyframe arrays go to writer
+        tracks = {}
+        for name in self.keyFrames.keys():
+            if len(self.keyFrames[name]) > 0:
+                track = self.getTrack(name)
+                tracks[name] = {"vector": track.vector, "frames": writer.add(track.frames), "values": writer.add(track.values), "slopes": writer.add(track.slopes)}
+        return {"type": type(self).__name__, "name": self.name, "pos": [self.pos[0], self.pos[1]], "angle": self.angle, "tracks": tracks}
+    def editTrack(self, key):
+        # the track of key ready for editing, its compiled version is dropped
+        track = self.keyFrames.get(key)
+        # tracks loaded from a project file are arrays until they are edited
+        if not isinstance(track, KeyTrack.Track):
+            track = KeyTrack.Track(track or ())
+            self.keyFrames[key] = track
+        self.compiledTracks.pop(key, None)
+        Shape._trackRevision += 1
+        Shape._editRevision += 1
+        return track
     def addKeyFrame(self, frame, key, value, slope=1):
-        k = KeyValue(frame, value, slope)
-        if key in self.keyFrames:
-            self.keyFrames[key].append(k)
-        else:
-            self.keyFrames[key] = [k]
-        # sort the keyframes by frame
-        self.keyFrames[key].sort(key=lambda x: x.frame)
-    def evaluateKeyframes(self):
-        currentFrame = Display.getInstance().timeLine.getCurrentFrame()
+        # replaces the key already on frame
+        self.editTrack(key).insert(KeyValue(frame, value, slope))
+    def addKeyFrames(self, key, frames, values, slopes=None):
+        # bulk insert of baked keys, sorted once instead of per key
+        if slopes is None:
+            slopes = [1] * len(frames)
+        self.editTrack(key).insertMany(map(KeyValue, frames, values, slopes))
+    def removeKeyFrames(self, key, start, end):
+        # delete the keys with start <= frame <= end, returns how many were deleted
+        return self.editTrack(key).remove(start, end)
+    def shiftKeyFrames(self, key, start, end, offset):
+        return self.editTrack(key).shift(start, end, offset)
+    def reduceKeyFrames(self, key, tolerance):
+        # drop keys the curve does not need to stay within tolerance, returns how many were dropped
+        track = self.getTrack(key)
+        reduced = KeyTrack.reduceTrack(track, tolerance)
+        removed = len(track) - len(reduced)
+        if removed > 0:
+            # kept as arrays like a loaded track, editTrack turns it into keys only when it is edited
+            self.keyFrames[key] = reduced
+            self.compiledTracks[key] = reduced
+            Shape._trackRevision += 1
+            Shape._editRevision += 1
+        return removed
+    def getTrack(self, key):
+        # numpy version of a keyframe track, compiled on first use
+        if key not in self.compiledTracks:
+            self.compiledTracks[key] = KeyTrack.CompiledTrack.fromKeys(self.keyFrames[key])
+        return self.compiledTracks[key]
+    def evaluateKeyframes(self, currentFrame=None):
+        if currentFrame is None:
+            currentFrame = Display.getInstance().timeLine.getCurrentFrame()
         currentKeys = {}
         for key in self.keyFrames.keys():
             list = self.keyFrames[key]
@@ -135,6 +307,8 @@ class Shape:
         return currentKeys
 
     def binary_search(self, list, target):
+        if len(list) == 1:
+            return (list[0], None)
         low = 0
         high = len(list) - 1
         while low < high:
@@ -156,22 +330,51 @@ class Shape:
         lowKey = None if low == 0 else list[low]
         return (lowKey, highKey)
 
-    def performKeyframes(self, currentKeys):
+    def evaluateAt(self, frame):
+        # values of the keyed properties at frame, does not change the shape
+        values = {}
+        currentKeys = self.evaluateKeyframes(frame)
         for key in currentKeys.keys():
-            if key == "pos":
-                newPos = self.keyframeInterpolate(currentKeys[key][0], currentKeys[key][1])
-                if not newPos:
-                    continue
-                self.move(newPos, abs=True)
+            value = self.keyframeInterpolate(currentKeys[key][0], currentKeys[key][1], frame)
+            if value is not None:
+                values[key] = value
+        return values
+    def evaluateTree(self, frame, transforms, sceneValues=None, parentMatrix=matrix.identity, parentAngle=0):
+        # world matrices are built from the evaluated parent, the live shapes are not touched
+        if sceneValues is None:
+            values = self.evaluateAt(frame)
+        else:
+            values = sceneValues.get(self, {})
+        pos = vectorCopy(values.get("pos", self.pos))
+        angle = values.get("angle", self.angle)
+        radius = values.get("radius", getattr(self, "radius", None))
+        localMatrix = matrix.fromPosAngle(pos, angle)
+        worldMatrix = matrix.multiply(parentMatrix, localMatrix)
+        transforms[self] = Transform(pos, angle, radius, localMatrix, worldMatrix, parentAngle + angle)
+        for child in self.children:
+            child.evaluateTree(frame, transforms, sceneValues, worldMatrix, parentAngle + angle)
+    def applyTransform(self, transform):
+        # only changed values are assigned, so unkeyed subtrees keep their cached world matrices
+        if transform.pos != self._pos:
+            self.pos = vectorCopy(transform.pos)
+        if transform.angle != self._angle:
+            self.angle = transform.angle
+        # parents are applied first, so a dirty shape can take the matrices that were already evaluated
+        if self.worldDirty:
+            self.localMatrix = transform.localMatrix
+            self.worldMatrix = transform.worldMatrix
+            self.worldAngle = transform.worldAngle
+            self.worldDirty = False
 
-    def keyframeInterpolate(self, key1, key2):
+    def keyframeInterpolate(self, key1, key2, frame=None):
         if key1 == None and key2 == None:
             return None
         if key1 == None:
             return key2.value
         if key2 == None:
             return key1.value
-        frame = Display.getInstance().timeLine.getCurrentFrame()
+        if frame is None:
+            frame = Display.getInstance().timeLine.getCurrentFrame()
 
         p0 = key1.slope
         p1 = key2.slope
@@ -181,40 +384,49 @@ class Shape:
         calculated_t = (p1 - 2 + p0) * t * t * t + (-p1 + 3 - 2 * p0) * t * t + p0 * t
         return key1.value + (key2.value - key1.value) * calculated_t
     def getAbsolutePos(self):
-        if self.parent == None:
-            return self.pos
-        return self.parent.getAbsolutePos() + self.pos
-    def step(self):
-        if Display._instance.timeLine.state != TIMELINE_PAUSE:
-            currentKeys = self.evaluateKeyframes()
-            self.performKeyframes(currentKeys)
-        for child in self.children:
-            child.step()
-        
-    def draw(self):
-        # might be wrong
-        for child in self.children:
-            child.draw()
-        # draw keyframes
-        for key in self.keyFrames.keys():
-            list = self.keyFrames[key]
-            for k in list:
-                timeLine = TimeLine.getInstance()
-                timeLine.drawKeyFrame(k)
-                # pygame.draw.circle(artBoard, (255, 0, 0), (k.frame, k.value), 5)
+        m = self.getWorldMatrix()
+        return Vector(m[4], m[5])
+    def getAbsoluteAngle(self):
+        if self.worldDirty:
+            self.updateWorld()
+        return self.worldAngle
+    def getDrawCommands(self, commands):
+        # append the (surface, dest) blits of this shape alone, children add their own
+        pass
+    def getKeyFrames(self):
+        # frames of all keys on all tracks, Track and CompiledTrack both keep them in frames
+        for track in self.keyFrames.values():
+            yield from track.frames
 class Circle(Shape):
     def __init__(self, pos, radius):
         self.initialize(pos)
         self.radius = radius
-    def performKeyframes(self, currentKeys):
-        super().performKeyframes(currentKeys)
-        for key in currentKeys.keys():
-            if key == "radius":
-                self.radius = self.keyframeInterpolate(currentKeys[key][0], currentKeys[key][1])
-    def draw(self):
-        pos = self.getParentPos() + self.pos
-        pygame.draw.circle(artBoard, (255, 255, 255), pos, self.radius)
-        super().draw()
+    def applyTransform(self, transform):
+        super().applyTransform(transform)
+        self.radius = transform.radius
+    def getBounds(self):
+        pos = self.getAbsolutePos()
+        radius = int(self.radius) + 2
+        return pygame.Rect(int(pos[0]) - radius, int(pos[1]) - radius, radius * 2 + 1, radius * 2 + 1)
+    def getDrawState(self):
+        return super().getDrawState() + (self.radius,)
+    def getRecord(self, writer, projectPath):
+        record = super().getRecord(writer, projectPath)
+        record["radius"] = self.radius
+        return record
+    def getSize(self):
+        return (int(self.radius * 2), int(self.radius * 2))
+    def setSize(self, size):
+        self.radius = min(size) / 2
+        Shape._editRevision += 1
+    def hitTest(self, point):
+        return distus(self.getAbsolutePos(), point) <= self.radius * self.radius
+    def getDrawCommands(self, commands):
+        if self.radius < 1:
+            return
+        pos = self.getAbsolutePos()
+        radius = int(self.radius)
+        commands.append((Cache.circleCache.circle((255, 255, 255), radius), (int(pos[0]) - radius, int(pos[1]) - radius)))
 
 class RotatableShape(Shape):
     def __init__(self, pos, anchor=Vector(), angle=0):
@@ -227,75 +439,161 @@ class RotatableShape(Shape):
         if self.parent == None:
             return 0
         return self.parent.angle
-    def setPosRel(self, vec):
-        self.pos = self.pos + vec
     def setAnchor(self, vec):
         self.anchor = vec
         self.pos = self.pos + self.anchor
+        Shape._editRevision += 1
+    def getRecord(self, writer, projectPath):
+        record = super().getRecord(writer, projectPath)
+        record["anchor"] = [self.anchor[0], self.anchor[1]]
+        return record
     def rotate(self, angle, abs=False):
+        # children keep their local positions, the parent angle is applied when resolving world positions
         if abs:
-            diff = angle - self.angle
             self.angle = angle
-            for child in self.children:
-                child.pos = rotateVector(child.pos, radians(-diff))
         else:
-            # not tested yet
             self.angle += angle
-            for child in self.children:
-                child.pos -= self.pos
-                child.pos.rotate(radians(self.angle))
-                child.pos += self.pos
-        
-    def performKeyframes(self, currentKeys):
-        super().performKeyframes(currentKeys)
-        for key in currentKeys.keys():
-            if key == "angle":
-                self.rotate(self.keyframeInterpolate(currentKeys[key][0], currentKeys[key][1]), abs=True)
-    def draw(self):
-        super().draw()
 
 class Surf(RotatableShape):
     def __init__(self, pos, surf):
         self.initialize(pos)
-        self.orgSurf = surf
-        self.surf = surf
+        # surf is either a pygame surface or a lazily loaded PsdLoader.Layer
+        if isinstance(surf, PsdLoader.Layer):
+            self.name = surf.name
+            self.layer = surf
+            self.orgSurf = None
+            self.surf = None
+            self.size = surf.size
+        else:
+            self.layer = None
+            self.orgSurf = surf
+            self.surf = surf
+            self.size = surf.get_size()
+    def getSurf(self):
+        if self.surf is None:
+            self.orgSurf = self.layer.getSurface()
+            if self.orgSurf.get_size() == tuple(self.size):
+                self.surf = self.orgSurf
+            else:
+                self.surf = pygame.transform.scale(self.orgSurf, self.size)
+        return self.surf
+    def unload(self):
+        # release the pixels of a psd layer, they are composed again when drawn
+        if self.layer is None or self.surf is None:
+            return
+        # rotated copies keep the source alive
+        Cache.rotozoomCache.discard(self.surf)
+        self.orgSurf = None
+        self.surf = None
+        self.layer.unload()
+    def isVisible(self):
+        return self.layer is None or self.layer.visible
+    def getRecord(self, writer, projectPath):
+        # psd layers are referenced, other surfaces are stored with the project
+        record = super().getRecord(writer, projectPath)
+        record["size"] = list(self.size)
+        if self.layer is not None:
+            record["layer"] = {"psd": ProjectFile.relativePath(self.layer.document.path, projectPath), "index": self.layer.index}
+        else:
+            width, height = self.orgSurf.get_size()
+            record["pixels"] = writer.add(pygame.image.tobytes(self.orgSurf, "RGBA"), (height, width, 4))
+        return record
     def setSize(self, size):
+        self.getSurf()
+        self.size = size
         self.surf = pygame.transform.scale(self.orgSurf, size)
+        Shape._editRevision += 1
     def getSize(self):
-        return self.surf.get_size()
-    def draw(self):
-        angle = self.getParentAngle() + self.angle
-        pos = self.getParentPos() + self.pos
-        # surf = pygame.transform.rotate(self.surf, angle)
-        surf = pygame.transform.rotozoom(self.surf, angle, 1.0)
+        return self.size
+    def getCenter(self, pos, angle):
+        # center of the surface after rotating it around pos
         anchorTag = pos + self.anchor
-        pos = pos - anchorTag
-        pos.rotate(-radians(angle))
-        pos = pos + anchorTag
-        artBoard.blit(surf, (pos - self.anchor) - Vector(surf.get_width() // 2, surf.get_height() // 2))
-        pygame.draw.circle(artBoard, (200,200,0), self.getAbsolutePos(), 2)
-        super().draw()
+        center = pos - anchorTag
+        center.rotate(-radians(angle))
+        center += anchorTag
+        center -= self.anchor
+        return center
+    def getBounds(self):
+        if not self.isVisible():
+            return None
+        angle = self.getAbsoluteAngle()
+        pos = self.getAbsolutePos()
+        center = self.getCenter(pos, angle)
+        width, height = self.size
+        c = abs(cos(radians(angle)))
+        s = abs(sin(radians(angle)))
+        rotatedWidth = int(width * c + height * s) + 4
+        rotatedHeight = int(width * s + height * c) + 4
+        bounds = pygame.Rect(0, 0, rotatedWidth, rotatedHeight)
+        bounds.center = (int(center[0]), int(center[1]))
+        return bounds.union(pygame.Rect(int(pos[0]) - 3, int(pos[1]) - 3, 7, 7))
+    def getDrawState(self):
+        return super().getDrawState() + (tuple(self.size), id(self.orgSurf), self.isVisible())
+    def hitTest(self, point):
+        if not self.isVisible():
+            return False
+        angle = self.getAbsoluteAngle()
+        center = self.getCenter(self.getAbsolutePos(), angle)
+        # undo the rotation of the surface and test against its unrotated rect
+        local = rotateVector(Vector(point[0] - center[0], point[1] - center[1]), radians(angle))
+        return abs(local.x) <= self.size[0] / 2 and abs(local.y) <= self.size[1] / 2
+    def getDrawCommands(self, commands):
+        if not self.isVisible():
+            return
+        angle = self.getAbsoluteAngle()
+        pos = self.getAbsolutePos()
+        surf = self.getSurf()
+        center = self.getCenter(pos, angle)
+        if Cache.rotozoomCache.quantize(angle) == 0:
+            # unrotated surfaces are blitted as they are, pieces of an atlas page straight from the page
+            center -= (surf.get_width() // 2, surf.get_height() // 2)
+            page = surf.get_parent()
+            if page is not None:
+                commands.append((page, center, pygame.Rect(surf.get_offset(), surf.get_size())))
+            else:
+                commands.append((surf, center))
+        else:
+            surf = Cache.rotozoomCache.rotozoom(surf, angle, 1.0)
+            center -= (surf.get_width() // 2, surf.get_height() // 2)
+            commands.append((surf, center))
+        # anchor
+        commands.append((Cache.circleCache.circle((200, 200, 0), 2), (int(pos[0]) - 2, int(pos[1]) - 2)))
 
 class Handle:
     _radius = 5
     _reg = []
+    # window rects of the handles for hover tests
+    _index = SpatialIndex.GridIndex(32)
     _state = "idle"
     def __init__(self, obj, pos, mode):
-        self.pos = tup2vec(pos)
         self.selected = False
         self.obj = obj
         self.mode = mode
+        self.pos = tup2vec(pos)
+    @property
+    def pos(self):
+        return self._pos
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos
+        Handle._index.update(self, self.getRect().inflate(2, 2))
+    def clear():
+        Handle._reg.clear()
+        Handle._index.clear()
     def step(self):
         mousePos = pygame.mouse.get_pos()
         if not Display._instance.selectedHandle and distus(mousePos, self.pos) < self._radius * self._radius:
             self.selected = True
             Display._instance.selectedHandle = self
+    def getRect(self):
+        return pygame.Rect(self.pos[0] - self._radius, self.pos[1] - self._radius, self._radius * 2, self._radius * 2)
     def draw(self):
         color = (255,255,255) if not self.selected else (0,255,0)
         # pygame.draw.circle(win, color, self.pos, self._radius, 1)
         pygame.draw.rect(win, color, (self.pos[0] - self._radius, self.pos[1] - self._radius, self._radius * 2, self._radius * 2))
 
     def updateHandles():
+        obj = Handle._reg[0].obj
         pos = tup2vec(obj.getAbsolutePos()) + artBoardPos
         size = tup2vec(obj.getSize())
         Handle._reg[0].pos = pos - size // 2
@@ -312,7 +610,7 @@ class Handle:
         pos = tup2vec(obj.getAbsolutePos()) + artBoardPos
         size = tup2vec(obj.getSize())
 
-        Handle._reg.clear()
+        Handle.clear()
 
         Handle._reg.append(Handle(obj, pos - size // 2, "tl"))
         Handle._reg.append(Handle(obj, pos - Vector(0, size.y // 2), "tm"))
@@ -329,7 +627,7 @@ class Handle:
         objAbsPos = self.obj.getAbsolutePos() + artBoardPos
         self.pos = mousePos
         if self.mode == "c":
-            obj.setPosRel(mousePos - objAbsPos)
+            self.obj.setPosRel(mousePos - objAbsPos)
             Handle.updateHandles()
         elif self.mode in ["tl", "tr", "bl", "br"]:
             newSize = (abs(objAbsPos.x - mousePos.x) * 2, abs(objAbsPos.y - mousePos.y) * 2)
@@ -362,31 +660,56 @@ class TimeLine:
         self.currentFrame = 0
         self.state = TIMELINE_PLAY
         self.selected = False
+        # in realtime mode the current frame follows the wall clock and frames that are late are dropped
+        self.realtime = False
+        self.playStart = None
+        self.playStartFrame = 0
+        self.playedFrames = 0
+        self.droppedFrames = 0
+        # keyframe marks of the whole scene, drawn once and blitted until keys or the layout change
+        self.keyStrip = None
+        self.keyStripKey = None
     def getInstance():
         return TimeLine._instance
     def frameToTime(frame):
         return (fps / TimeLine.animationFps) * frame
 
     def getCurrentFrame(self):
-        return int((TimeLine.animationFps / fps) * self.timeOverall)
+        return self.currentFrame
     def togglePlay(self):
         if self.state == TIMELINE_PLAY:
             self.state = TIMELINE_PAUSE
         else:
             self.state = TIMELINE_PLAY
+        self.playStart = None
     def restart(self):
         self.timeOverall = 0
         self.currentFrame = 0
+        self.playStart = None
+    def stepRealtime(self):
+        now = time.perf_counter()
+        if self.playStart is None:
+            self.playStart = now
+            self.playStartFrame = self.currentFrame
+            self.playedFrames = 0
+        played = int((now - self.playStart) * TimeLine.animationFps)
+        if played > self.playedFrames + 1:
+            self.droppedFrames += played - self.playedFrames - 1
+        self.playedFrames = played
+        self.setCurrentFrame((self.playStartFrame + played) % self.frameCount)
 
     def step(self):
-        mousePos = pygame.mouse.get_pos()
-        seekerPos = self.getSeekerPosInWin(self.currentFrame)
-        if distus(mousePos, seekerPos) < 10 * 10:
-            self.selected = True
-        else:
-            self.selected = False
-        
-        if self.state == TIMELINE_PLAY:
+        if win is not None:
+            mousePos = pygame.mouse.get_pos()
+            seekerPos = self.getSeekerPosInWin(self.currentFrame)
+            if distus(mousePos, seekerPos) < 10 * 10:
+                self.selected = True
+            else:
+                self.selected = False
+
+        if self.state == TIMELINE_PLAY and self.realtime:
+            self.stepRealtime()
+        elif self.state == TIMELINE_PLAY:
             if self.timeOverall >= TimeLine.frameToTime(self.frameCount):
                 self.timeOverall = 0
                 self.currentFrame = 0
@@ -403,18 +726,55 @@ class TimeLine:
             elif currentFrame > self.frameCount:
                 currentFrame = self.frameCount
             self.setCurrentFrame(currentFrame)
+    def getNextFrame(self):
+        # the frame step will most likely show on the next tick
+        if self.state == TIMELINE_PLAY and self.realtime:
+            if self.playStart is None:
+                return self.currentFrame
+            played = int((time.perf_counter() + 1 / fps - self.playStart) * TimeLine.animationFps)
+            return (self.playStartFrame + played) % self.frameCount
+        if self.state == TIMELINE_PLAY:
+            timeOverall = self.timeOverall
+            if timeOverall >= TimeLine.frameToTime(self.frameCount):
+                timeOverall = 0
+            return int((TimeLine.animationFps / fps) * timeOverall)
+        return self.currentFrame
     def setCurrentFrame(self, frame):
         self.currentFrame = frame
         self.timeOverall = int(TimeLine.frameToTime(frame))
+    def getRect(self):
+        # window area covered by the timeline, seeker and keyframes
+        return pygame.Rect(40, win.get_height() - 60, win.get_width() - 80, 21)
+    def getDrawState(self):
+        return (self.currentFrame, self.selected, self.state, Shape._trackRevision, win.get_size())
     def getSeekerPosInWin(self, frame):
         pos1 = Vector(50, win.get_height() - 50)
         pos2 = Vector(win.get_width() - 50, win.get_height() - 50)
         return pos1 + (pos2 - pos1) * (frame / self.frameCount)
 
-    def drawKeyFrame(self, key):
-        keyFramePos = self.getSeekerPosInWin(key.frame)
-        # pygame.draw.circle(win, (255, 0, 0), keyFramePos, 2)
-        pygame.draw.polygon(win, (255,255,0), [keyFramePos + tup2vec(i) for i in keyFrameDiamond])
+    def getKeyStrip(self):
+        key = (Shape._trackRevision, tuple(map(id, objects)), win.get_width(), self.frameCount)
+        if key != self.keyStripKey:
+            self.keyStrip = self.drawKeyStrip()
+            self.keyStripKey = key
+        return self.keyStrip
+    def drawKeyStrip(self):
+        # one mark per pixel column holding keys, no matter how many keys share it
+        left = 50
+        scale = (win.get_width() - 100) / self.frameCount
+        columns = set()
+        for shape in getDrawOrder(objects):
+            columns.update(int(left + frame * scale) for frame in shape.getKeyFrames())
+        strip = pygame.Surface((win.get_width(), 9), pygame.SRCALPHA)
+        strip.fill((0, 0, 0, 0))
+        # diamonds need room, when frames are packed closer they become ticks
+        if scale >= 6:
+            for x in columns:
+                pygame.draw.polygon(strip, (255,255,0), translatePoints(keyFrameDiamond, (x, 4)))
+        else:
+            for x in columns:
+                strip.fill((255,255,0), (x, 0, 1, 9))
+        return strip
 
     def draw(self):
         currentFramePos = self.getSeekerPosInWin(self.currentFrame)
@@ -425,6 +785,7 @@ class TimeLine:
         if self.selected or self.state == TIMELINE_DRAG:
             pygame.draw.circle(win, (255, 0, 0), currentFramePos, 8)
         pygame.draw.circle(win, (255, 255, 255), currentFramePos, 5)
+        win.blit(self.getKeyStrip(), (0, win.get_height() - 54))
 
 # singleton renderer
 class Renderer:
@@ -433,23 +794,231 @@ class Renderer:
         if not cls._instance:
             cls._instance = super(Renderer, cls).__new__(cls, *args, **kwargs)
         return cls._instance
-    def renderPNGSequance(self, path, name):
+    def renderPNGSequance(self, path, name, workers=1, compressLevel=6):
+        frameCount = TimeLine._instance.frameCount
+        if workers > 1 and currentScene is None:
+            # worker processes rebuild the scene by name, shapes created from python only exist in this process
+            raise ValueError("rendering with " + str(workers) + " workers needs a scene loaded with loadScene")
+        if workers > 1:
+            # split the frames into one contiguous chunk per worker process
+            chunk = -(-frameCount // workers)
+            # the png threads of all workers together use every core once
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            settings = getRenderSettings()
+            with ProcessPoolExecutor(workers) as pool:
+                jobs = [pool.submit(renderChunk, currentScene, path, name, start, min(start + chunk, frameCount), compressLevel, threads, settings) for start in range(0, frameCount, chunk)]
+                for job in jobs:
+                    job.result()
+            return
+        self.renderFrames(path, name, 0, frameCount, compressLevel)
+    def renderFrames(self, path, name, start, end, compressLevel=6, threads=None):
         timeline = TimeLine._instance
-        frameCount = timeline.frameCount
-        timeline.restart()
-        for i in range(frameCount):
-            timeline.step()
-            for obj in objects:
-                obj.step()
+        state = timeline.state
+        # render every animation frame regardless of the editor playback state
+        timeline.state = TIMELINE_PLAY
+        # frames are compressed and saved in the background while the next ones are drawn
+        writer = Encoder.AsyncPngWriter(threads, compressLevel=compressLevel)
+        try:
+            for i in range(start, end):
+                self.drawFrame(i)
+                # save frame to path  with frame number with 4 digits
+                with profiler.section("save"):
+                    writer.write(artBoard, path + "/" + name + str(i).zfill(4) + ".png")
+                profiler.endFrame()
+        finally:
+            writer.close()
+            timeline.state = state
+            timeline.restart()
+    def renderVideo(self, path, queueSize=8):
+        # stream the frames to a video encoder running next to the render loop
+        timeline = TimeLine._instance
+        state = timeline.state
+        timeline.state = TIMELINE_PLAY
+        writer = Encoder.openWriter(path, artBoard.get_size(), TimeLine.animationFps, queueSize)
+        try:
+            for i in range(timeline.frameCount):
+                self.drawFrame(i)
+                with profiler.section("save"):
+                    writer.write(artBoard)
+                profiler.endFrame()
+        finally:
+            writer.close()
+            timeline.state = state
+            timeline.restart()
+    def drawFrame(self, frame):
+        profiler.beginFrame()
+        TimeLine._instance.setCurrentFrame(frame)
+        with profiler.section("evaluate"):
+            applyTransforms(evaluate(objects, frame))
+        with profiler.section("draw"):
             artBoard.fill((0,0,0,0))
-            for obj in objects:
-                obj.draw()
-            # save frame to path  with frame number with 4 digits
-            pygame.image.save(artBoard, path + "/" + name + str(i).zfill(4) + ".png")
-        timeline.restart()
+            artBoard.blits(getDisplayList(objects), doreturn=False)
+
+def walkShapes(scene):
+    # every shape in scene, parents before their children
+    for obj in scene:
+        yield obj
+        yield from walkShapes(obj.children)
+
+drawOrder = None
+drawOrderKey = None
+
+def getDrawOrder(scene):
+    # walkShapes of scene as a list, rebuilt when the hierarchy changes
+    global drawOrder, drawOrderKey
+    key = (Shape._trackRevision, tuple(map(id, scene)))
+    if key != drawOrderKey:
+        drawOrder = list(walkShapes(scene))
+        drawOrderKey = key
+    return drawOrder
+
+def getDisplayList(scene, rects=None):
+    # blits of every shape in scene in z order, submitted at once with artBoard.blits,
+    # shapes painting nothing inside rects (the whole artBoard by default) are skipped so their pixels are not loaded
+    if rects is None:
+        rects = [artBoard.get_rect()]
+    commands = []
+    for shape in getDrawOrder(scene):
+        bounds = shape.getBounds()
+        if bounds is None or bounds.collidelist(rects) < 0:
+            continue
+        if profiler.enabled:
+            with profiler.measure(shape.name, "draw"):
+                shape.getDrawCommands(commands)
+        else:
+            shape.getDrawCommands(commands)
+    return commands
+
+sceneTracks = None
+sceneTracksKey = None
+
+def getSceneTracks(scene):
+    # all keyframe tracks of the scene packed in one TrackSet, rebuilt when keys or hierarchy change
+    global sceneTracks, sceneTracksKey
+    key = (Shape._trackRevision, tuple(map(id, scene)))
+    if key != sceneTracksKey:
+        owners = []
+        tracks = []
+        for shape in walkShapes(scene):
+            for name in shape.keyFrames.keys():
+                if len(shape.keyFrames[name]) > 0:
+                    owners.append((shape, name))
+                    tracks.append(shape.getTrack(name))
+        sceneTracks = (owners, KeyTrack.TrackSet(tracks))
+        sceneTracksKey = key
+    return sceneTracks
+
+def evaluate(scene, frame):
+    # resolve the transform of every shape in scene at frame without stepping anything
+    owners, trackSet = getSceneTracks(scene)
+    sceneValues = {}
+    for (shape, name), value in zip(owners, trackSet.valuesAt(frame)):
+        sceneValues.setdefault(shape, {})[name] = value
+    transforms = {}
+    for obj in scene:
+        obj.evaluateTree(frame, transforms, sceneValues)
+    return transforms
+
+# artBoard bounds of the drawn shapes, for picking
+shapeIndex = SpatialIndex.GridIndex()
+
+def collectDirtyRects(scene):
+    # artBoard rects of every shape whose drawing changed, both where it was and where it is now
+    rects = []
+    for zIndex, shape in enumerate(getDrawOrder(scene)):
+        shape.zIndex = zIndex
+        state = shape.getDrawState()
+        if state != shape.drawnState:
+            if shape.drawnBounds:
+                rects.append(shape.drawnBounds)
+            bounds = shape.getBounds()
+            if bounds:
+                rects.append(bounds)
+            shape.drawnState = state
+            shape.drawnBounds = bounds
+            shapeIndex.update(shape, bounds)
+    return rects
+
+def reduceKeyFrames(scene, tolerance):
+    # reduce every track of the scene, returns the number of keys before and after
+    before = 0
+    removed = 0
+    for shape in walkShapes(scene):
+        for name in list(shape.keyFrames.keys()):
+            before += len(shape.keyFrames[name])
+            if len(shape.keyFrames[name]) > 0:
+                removed += shape.reduceKeyFrames(name, tolerance)
+    return before, before - removed
+
+def unloadHidden(scene):
+    # drop the pixels of psd layers that are hidden or outside the artBoard, uses the bounds of the last dirty pass
+    boardRect = artBoard.get_rect()
+    for shape in walkShapes(scene):
+        if isinstance(shape, Surf) and shape.layer is not None and shape.surf is not None:
+            if shape.drawnBounds is None or not shape.drawnBounds.colliderect(boardRect):
+                shape.unload()
+
+def applyTransforms(transforms):
+    for shape, transform in transforms.items():
+        shape.applyTransform(transform)
+
+# transforms of every shape at one frame, not changed anymore once it is handed to the main thread
+class FrameSnapshot:
+    def __init__(self, scene, frame, revision):
+        self.frame = frame
+        self.revision = revision
+        self.transforms = evaluate(scene, frame)
+
+# evaluates the next frame on a worker thread while the main thread draws the current one,
+# the worker only reads the scene, so the main thread waits for it before handling edits.
+# without a worker frames are evaluated when they are applied, frames already applied are skipped either way
+class Evaluator:
+    def __init__(self, pipelined=True):
+        self.pool = ThreadPoolExecutor(1) if pipelined else None
+        self.pending = None
+        self.requested = None
+        self.applied = None
+        self.hits = 0
+        self.misses = 0
+    def request(self, frame):
+        key = (frame, Shape._editRevision)
+        if self.pool is None or key == self.applied or key == self.requested:
+            return
+        self.wait()
+        self.pending = self.pool.submit(FrameSnapshot, objects, frame, Shape._editRevision)
+        self.requested = key
+    def wait(self):
+        if self.pending is not None:
+            self.pending.exception()
+    def apply(self, frame):
+        # move the shapes to frame, from the snapshot of the worker when it guessed the frame right
+        key = (frame, Shape._editRevision)
+        if key == self.applied:
+            return
+        snapshot = self.pending.result() if self.pending is not None else None
+        self.pending = None
+        self.requested = None
+        if snapshot is not None and (snapshot.frame, snapshot.revision) == key:
+            self.hits += 1
+            transforms = snapshot.transforms
+        else:
+            self.misses += 1
+            transforms = evaluate(objects, frame)
+        applyTransforms(transforms)
+        self.applied = key
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+
+def loadImage(path):
+    image = pygame.image.load(path)
+    if Cache.hasDisplay():
+        return image.convert_alpha()
+    return image
 
 # init
 objects = []
+currentScene = None
 
 def test1():
 
@@ -468,7 +1037,7 @@ def test1():
     c.addKeyFrame(100, "radius", 20)
     c.addKeyFrame(150, "radius", 10)
 
-    s = Surf((300,300), pygame.image.load("D:/python/assets/anchor.png").convert_alpha())
+    s = Surf((300,300), loadImage("D:/python/assets/anchor.png"))
     s.setAnchor(Vector(-45, 0))
     
     objects.append(s)
@@ -481,15 +1050,15 @@ def test1():
     s.addKeyFrame(0, "angle", 0)
     s.addKeyFrame(25 * 6, "angle", 360)
 
-    s2 = Surf((200,300), pygame.image.load("D:/python/assets/blood3.png").convert_alpha())
-    s.children.append(s2)
+    s2 = Surf(s.pos + Vector(200,300), loadImage("D:/python/assets/blood3.png"))
+    s.addChild(s2)
 
 def test2():
-    layers = PsdLoader.loadToLayers("D:\\python\\assets\\hand.psd")
-    arm = Surf(layers[0][1], layers[0][0])
+    layers = PsdLoader.loadLazy("D:\\python\\assets\\hand.psd")
+    arm = Surf(layers[0].pos, layers[0])
     arm.setAnchor(Vector(13, 30))
     objects.append(arm)
-    hand = Surf(layers[1][1], layers[1][0])
+    hand = Surf(layers[1].pos, layers[1])
     hand.setAnchor(Vector(-5, 80))
     
     arm.addChild(hand)
@@ -525,12 +1094,12 @@ def test2():
     hand.addKeyFrame(110, "angle", 20)
 
 def test3():
-    layers = PsdLoader.loadToLayers("D:\\python\\assets\\layertest2.psd")
-    arm = Surf(layers[0][1], layers[0][0])
+    layers = PsdLoader.loadLazy("D:\\python\\assets\\layertest2.psd")
+    arm = Surf(layers[0].pos, layers[0])
     arm.setAnchor(Vector(0, 0))
     objects.append(arm)
-    arm2 = Surf(layers[1][1], layers[1][0])
-    arm3 = Surf(layers[2][1], layers[2][0])
+    arm2 = Surf(layers[1].pos, layers[1])
+    arm3 = Surf(layers[2].pos, layers[2])
     objects.append(arm2)
     objects.append(arm3)
     # hand = Surf(layers[1][1], layers[1][0])
@@ -552,55 +1121,327 @@ def testHandle():
     Display._instance.selectedObj = hadi
     Handle.createHandles(Display._instance.selectedObj)
 
+scenes = {
+    "test1": test1,
+    "test2": test2,
+    "test3": test3,
+    "testHandle": testHandle,
+}
+
 display = Display()
 
-testHandle()
+def loadScene(scene):
+    global currentScene
+    currentScene = scene
+    objects.clear()
+    shapeIndex.clear()
+    Handle.clear()
+    display.selectedObj = None
+    display.selectedHandle = None
+    display.timeLine.restart()
+    # a scene is either the name of a scene function or the path of a project file
+    if scene.endswith(ProjectFile.extension):
+        loadProject(scene)
+    else:
+        scenes[scene]()
 
-r = Renderer()
-r.renderPNGSequance('D:\\python\\assets\\testAnim', 'tester')
+def saveProject(path, scene=None):
+    # the shapes as they are now and all their keyframe tracks
+    scene = objects if scene is None else scene
+    writer = ProjectFile.Writer()
+    shapes = getDrawOrder(scene)
+    ids = {shape: i for i, shape in enumerate(shapes)}
+    records = []
+    for shape in shapes:
+        record = shape.getRecord(writer, path)
+        record["parent"] = ids[shape.parent] if shape.parent else -1
+        records.append(record)
+    writer.write(path, {"version": 1, "frameCount": display.timeLine.frameCount, "shapes": records})
 
-done = False
-while not done:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            done = True
-        display.handleEvents(event)
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            pass
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_s:
-                # set keyFrame temporary pos
-                obj = display.selectedObj
-                obj.addKeyFrame(display.timeLine.currentFrame, "pos", vectorCopy(obj.pos))
+def createShape(record, reader, documents):
+    pos = Vector(*record["pos"])
+    if record["type"] == "Circle":
+        return Circle(pos, record["radius"])
+    if record["type"] == "Surf":
+        if "layer" in record:
+            # every psd is opened once, documents maps its path to its layers
+            psd = reader.resolve(record["layer"]["psd"])
+            if psd not in documents:
+                documents[psd] = PsdLoader.loadLazy(psd)
+            shape = Surf(pos, documents[psd][record["layer"]["index"]])
+        else:
+            pixels = reader.array(record["pixels"])
+            shape = Surf(pos, PsdLoader.toSurface(pixels, (pixels.shape[1], pixels.shape[0]))[0])
+        if tuple(record["size"]) != tuple(shape.size):
+            shape.setSize(tuple(record["size"]))
+    elif record["type"] == "RotatableShape":
+        shape = RotatableShape(pos)
+    else:
+        shape = Shape(pos)
+    if "anchor" in record:
+        shape.anchor = Vector(*record["anchor"])
+    return shape
+
+def loadProject(path):
+    # keyframe tracks stay arrays mapped from the file, no KeyValue is created until a track is edited
+    reader = ProjectFile.Reader(path)
+    display.timeLine.frameCount = reader.header["frameCount"]
+    shapes = []
+    documents = {}
+    for record in reader.header["shapes"]:
+        shape = createShape(record, reader, documents)
+        shape.name = record["name"]
+        for name, ref in record["tracks"].items():
+            track = KeyTrack.CompiledTrack(reader.array(ref["frames"]), reader.array(ref["values"]), reader.array(ref["slopes"]), ref["vector"])
+            shape.keyFrames[name] = track
+            shape.compiledTracks[name] = track
+        if record["parent"] < 0:
+            objects.append(shape)
+        else:
+            shapes[record["parent"]].addChild(shape)
+        # positions are stored local to the parent
+        shape.pos = Vector(*record["pos"])
+        shape.angle = record["angle"]
+        shapes.append(shape)
+    Shape._trackRevision += 1
+    Shape._editRevision += 1
+
+def renderHeadless(scene, path, name, workers=1, compressLevel=6):
+    # render a scene to a png sequence without creating a window
+    loadScene(scene)
+    Renderer().renderPNGSequance(path, name, workers, compressLevel)
+
+def renderVideoHeadless(scene, path):
+    # render a scene to a video file, or raw frames when path ends with .rgba
+    loadScene(scene)
+    Renderer().renderVideo(path)
+
+def getRenderSettings():
+    # module settings the command line changes, workers started by spawn do not run __main__ and lose them
+    return {"rotationTolerance": Cache.rotozoomCache.tolerance, "atlasPageSize": PsdLoader.atlasPageSize, "cacheDir": PsdLoader.cacheDir}
+
+def applyRenderSettings(settings):
+    Cache.rotozoomCache.tolerance = settings["rotationTolerance"]
+    PsdLoader.atlasPageSize = settings["atlasPageSize"]
+    PsdLoader.cacheDir = settings["cacheDir"]
+
+def renderChunk(scene, path, name, start, end, compressLevel=6, threads=None, settings=None):
+    # entry point of a render worker process, every worker builds its own scene and artBoard
+    if settings is not None:
+        applyRenderSettings(settings)
+    loadScene(scene)
+    Renderer().renderFrames(path, name, start, end, compressLevel, threads)
+
+def runEditor(scene, realtime=False, pipelined=False):
+    initWindow()
+    loadScene(scene)
+    display.timeLine.realtime = realtime
+    droppedFrames = None
+    evaluator = Evaluator(pipelined)
+
+    done = False
+    fullRedraw = True
+    # (frame, revision) on the artBoard, when it was taken from the ram preview the shapes were not moved to it
+    shown = None
+    previewShown = False
+    while not done:
+        profiler.beginFrame()
+        # the scene must not change while the worker reads it
+        with profiler.section("wait"):
+            evaluator.wait()
+        with profiler.section("events"):
+            events = pygame.event.get()
+            # picking and edits need the shapes where the artBoard shows them
+            if previewShown and any(event.type in (pygame.MOUSEBUTTONDOWN, pygame.KEYDOWN) for event in events):
+                showShapes(evaluator, shown[0])
+                previewShown = False
+            for event in events:
+                if event.type == pygame.QUIT:
+                    done = True
+                if event.type in (pygame.VIDEORESIZE, pygame.WINDOWEXPOSED):
+                    fullRedraw = True
+                display.handleEvents(event)
+                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    pass
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_s and display.selectedObj:
+                        # set keyFrame temporary pos
+                        obj = display.selectedObj
+                        obj.addKeyFrame(display.timeLine.currentFrame, "pos", vectorCopy(obj.pos))
+                    if event.key == pygame.K_F3:
+                        profiler.enabled = not profiler.enabled
+                        fullRedraw = True
+                    if event.key == pygame.K_F4:
+                        profiler.dump("trace.json")
 
         
-    keys = pygame.key.get_pressed()
-    if keys[pygame.K_ESCAPE]:
-        done = True
+        keys = pygame.key.get_pressed()
+        if keys[pygame.K_ESCAPE]:
+            done = True
+
+        # step
+        with profiler.section("Display.step"):
+            display.step()
+        # timeLine.step()
+
+        # if timeLine.timeOverall == 60:
+        #     objects[0].rotate(10)
+
+        # while playing or scrubbing, frames drawn before are taken from the ram preview without evaluating,
+        # moving or diffing the shapes, handles of a selected shape need them moved
+        frame = display.timeLine.currentFrame
+        key = (frame, Shape._editRevision)
+        playing = display.timeLine.state != TIMELINE_PAUSE
+        previewing = playing and display.selectedObj is None
+        if previewShown and not previewing:
+            showShapes(evaluator, shown[0])
+            previewShown = False
+        cached = None
+        if previewing and key != shown:
+            cached = Cache.frameCache.lookup(frame, Shape._editRevision)
+        artRects = []
+        if cached is None and not (previewShown and key == shown):
+            if previewShown:
+                # the dirty rects of the shapes know nothing about the preview frame on the artBoard
+                fullRedraw = True
+                previewShown = False
+            if playing:
+                with profiler.section("step"):
+                    # all tracks of the scene at once through the TrackSet, only when the frame or the scene changed
+                    evaluator.apply(frame)
+                    evaluator.request(display.timeLine.getNextFrame())
+            artRects = collectDirtyRects(objects)
+            # only a change of the artBoard can move a layer out of it
+            if not playing and artRects:
+                unloadHidden(objects)
+
+        # draw
+        uiRects = display.collectDirtyRects()
+        if profiler.enabled:
+            uiRects.append(getProfilerRect())
+        if fullRedraw:
+            with profiler.section("draw"):
+                if cached is not None:
+                    showFrame(cached)
+                elif not previewShown:
+                    redrawArtBoard(None)
+            with profiler.section("blit"):
+                drawWindow()
+            with profiler.section("display.update"):
+                pygame.display.update()
+            fullRedraw = False
+        elif artRects or uiRects or cached is not None:
+            with profiler.section("draw"):
+                if cached is not None:
+                    showFrame(cached)
+                    artRects = [artBoard.get_rect()]
+                else:
+                    artRects = mergeRects(artRects, artBoard.get_rect())
+                    redrawArtBoard(artRects)
+            with profiler.section("blit"):
+                winRects = mergeRects([r.move(artBoardPos[0], artBoardPos[1]) for r in artRects] + uiRects, win.get_rect())
+                for rect in winRects:
+                    win.set_clip(rect)
+                    drawWindow()
+                win.set_clip(None)
+            with profiler.section("display.update"):
+                pygame.display.update(winRects)
+        if cached is not None:
+            previewShown = True
+        elif playing and not previewShown and frame not in Cache.frameCache.entries:
+            Cache.frameCache.store(frame, Shape._editRevision, artBoard)
+        shown = key
+        if display.timeLine.realtime and display.timeLine.droppedFrames != droppedFrames:
+            droppedFrames = display.timeLine.droppedFrames
+            pygame.display.set_caption("Animator - dropped frames: " + str(droppedFrames))
+        profiler.endFrame()
+        clock.tick(fps)
+    evaluator.close()
 
-    # step
-    display.step()
-    # timeLine.step()
+def mergeRects(rects, bounds):
+    # clip rects to bounds and fall back to their union when there are many of them
+    rects = [r.clip(bounds) for r in rects]
+    rects = [r for r in rects if r.width > 0 and r.height > 0]
+    if len(rects) > 8:
+        return [rects[0].unionall(rects[1:])]
+    return rects
 
-    # if timeLine.timeOverall == 60:
-    #     objects[0].rotate(10)
+def showFrame(surface):
+    # max blending onto the cleared artBoard copies a ram preview frame without premultiplying it
+    artBoard.fill((0,0,0,0))
+    artBoard.blit(surface, (0, 0), None, pygame.BLEND_RGBA_MAX)
+
+def showShapes(evaluator, frame):
+    # move the shapes to the ram preview frame on the artBoard, its pixels are right already so the dirty rects are dropped
+    evaluator.apply(frame)
+    collectDirtyRects(objects)
 
-    for obj in objects:
-        obj.step()
+def redrawArtBoard(rects):
+    # redraw the whole artBoard, or only the given rects of it
+    if rects is None:
+        artBoard.fill((0,0,0,0))
+        artBoard.blits(getDisplayList(objects), doreturn=False)
+        return
+    if len(rects) == 0:
+        return
+    commands = getDisplayList(objects, rects)
+    for rect in rects:
+        artBoard.set_clip(rect)
+        artBoard.fill((0,0,0,0))
+        artBoard.blits(commands, doreturn=False)
+    artBoard.set_clip(None)
 
-    # draw
+def drawWindow():
     win.fill((20, 20, 20))
     pygame.draw.rect(win, (0, 0, 0), (artBoardPos, artBoard.get_size()))
     win.blit(artBoard, artBoardPos)
     pygame.draw.rect(win, (255, 255, 255), (artBoardPos, artBoard.get_size()), 1)
     display.draw()
-    artBoard.fill((0,0,0,0))
-    # timeLine.draw()
-    for obj in objects:
-        obj.draw()
-    
-    
+    if profiler.enabled:
+        profiler.drawOverlay(win, getProfilerRect().bottomleft)
+
+def getProfilerRect():
+    # the profiler overlay sits right above the timeline
+    return profiler.getOverlayRect((50, win.get_height() - 62))
+def parseArgs():
+    parser = argparse.ArgumentParser(description="software for composing and rendering animations")
+    parser.add_argument("--scene", default="testHandle", choices=scenes.keys())
+    parser.add_argument("--project", metavar="FILE", help="load a " + ProjectFile.extension + " project file instead of a scene")
+    parser.add_argument("--save-project", metavar="FILE", help="save the loaded scene as a project file and exit")
+    parser.add_argument("--reduce-keys", type=float, metavar="TOLERANCE", help="remove keyframes the curves do not need to stay within TOLERANCE, used with --save-project")
+    parser.add_argument("--render", metavar="DIR", help="render the scene headless to a png sequence in DIR")
+    parser.add_argument("--name", default="frame", help="file name prefix of rendered frames")
+    parser.add_argument("--video", metavar="FILE", help="render the scene headless to a video through ffmpeg, or to raw frames for a .rgba file")
+    parser.add_argument("--realtime", action="store_true", help="play back in real time, dropping frames that cannot be drawn in time")
+    parser.add_argument("--pipeline", action="store_true", help="evaluate the next frame on a worker thread while the current one is drawn")
+    parser.add_argument("--rotation-tolerance", type=float, default=Cache.rotozoomCache.tolerance, help="angle step in degrees within which rotated surfaces are reused")
+    parser.add_argument("--preview-memory", type=int, default=Cache.frameCache.budget // (1024 * 1024), help="megabytes of rendered frames kept for the ram preview")
+    parser.add_argument("--profile", action="store_true", help="show the profiler overlay, toggled with F3 and dumped to trace.json with F4")
+    parser.add_argument("--trace", metavar="FILE", help="profile and write a json trace to FILE on exit")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes rendering frames in parallel")
+    parser.add_argument("--atlas", type=int, metavar="SIZE", help="pack the visible psd layers into atlas pages of SIZE by SIZE pixels at load time")
+    parser.add_argument("--png-compression", type=int, default=6, choices=range(10), help="zlib level of rendered png frames, 0 is fastest")
+    return parser.parse_args()
 
-    pygame.display.update()
-    clock.tick(fps)
-pygame.quit()
\ No newline at end of file
+if __name__ == "__main__":
+    args = parseArgs()
+    Cache.rotozoomCache.tolerance = args.rotation_tolerance
+    Cache.frameCache.budget = args.preview_memory * 1024 * 1024
+    profiler.enabled = args.profile or args.trace is not None
+    PsdLoader.atlasPageSize = args.atlas
+    scene = args.project or args.scene
+    if args.save_project:
+        loadScene(scene)
+        if args.reduce_keys is not None:
+            before, after = reduceKeyFrames(objects, args.reduce_keys)
+            print("reduced " + str(before) + " keys to " + str(after) + ", removed " + str(before - after))
+        saveProject(args.save_project)
+    elif args.render:
+        renderHeadless(scene, args.render, args.name, args.workers, args.png_compression)
+    elif args.video:
+        renderVideoHeadless(scene, args.video)
+    else:
+        runEditor(scene, args.realtime, args.pipeline)
+    if args.trace:
+        profiler.dump(args.trace)
+    pygame.quit()
@@ -0,0 +1,24 @@
+from math import radians, sin, cos
+
+# 2d affine matrices are tuples (a, b, c, d, tx, ty) mapping (x, y) to (a*x + c*y + tx, b*x + d*y + ty)
+
+identity = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+def fromPosAngle(pos, angle):
+    # angle in degrees, rotating the same way as rotateVector(vec, -radians(angle))
+    r = -radians(angle)
+    c = cos(r)
+    s = sin(r)
+    return (c, s, -s, c, pos[0], pos[1])
+
+def multiply(m1, m2):
+    # the matrix applying m2 first and then m1
+    return (m1[0] * m2[0] + m1[2] * m2[1],
+            m1[1] * m2[0] + m1[3] * m2[1],
+            m1[0] * m2[2] + m1[2] * m2[3],
+            m1[1] * m2[2] + m1[3] * m2[3],
+            m1[0] * m2[4] + m1[2] * m2[5] + m1[4],
+            m1[1] * m2[4] + m1[3] * m2[5] + m1[5])
+
+def applyTo(m, point):
+    return (m[0] * point[0] + m[2] * point[1] + m[4], m[1] * point[0] + m[3] * point[1] + m[5])
@@ -0,0 +1,93 @@
+import os
+import random
+import numpy as np
+import pytest
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import KeyTrack
+from KeyTrack import KeyValue, Track, CompiledTrack, TrackSet
+from vector import Vector
+import main
+
+def randomShape(rng, keys):
+    shape = main.Circle(Vector(0, 0), 5)
+    frames = sorted(rng.sample(range(200), keys))
+    for frame in frames:
+        shape.addKeyFrame(frame, "pos", Vector(rng.uniform(-500, 500), rng.uniform(-500, 500)), rng.choice([0, 0.5, 1, 2, 3]))
+        shape.addKeyFrame(frame, "radius", rng.uniform(0, 50), rng.choice([0, 1, 3]))
+    return shape
+
+def values(value):
+    if isinstance(value, Vector):
+        return [value.x, value.y]
+    return [value]
+
+def test_trackSetMatchesKeyframeInterpolate():
+    # the numpy path of the scene evaluation against the per key python path of Shape
+    rng = random.Random(1)
+    shapes = [randomShape(rng, rng.randint(1, 12)) for _ in range(20)]
+    owners = [(shape, name) for shape in shapes for name in shape.keyFrames.keys()]
+    trackSet = TrackSet([shape.getTrack(name) for shape, name in owners])
+    for frame in [-10, 0, 0.25, 1, 7.5, 33, 99.9, 150, 199, 250]:
+        for (shape, name), value in zip(owners, trackSet.valuesAt(frame)):
+            expected = shape.evaluateAt(frame)[name]
+            assert values(value) == pytest.approx(values(expected), abs=1e-9)
+
+def test_compiledTrackMatchesTrackSet():
+    rng = random.Random(2)
+    shape = randomShape(rng, 8)
+    track = shape.getTrack("pos")
+    trackSet = TrackSet([track])
+    for frame in np.linspace(-5, 205, 97):
+        assert track.evaluate(frame)[0] == pytest.approx(trackSet.evaluateAt(frame)[0])
+
+def bakedTrack(frames):
+    values = [(250 + 100 * np.sin(i / 10), 250 + 80 * np.cos(i / 15)) for i in frames]
+    return CompiledTrack(frames, values, [1] * len(frames), True)
+
+@pytest.mark.parametrize("tolerance", [0.1, 0.5, 2.0])
+def test_reduceTrackStaysWithinTolerance(tolerance):
+    # reduceTrack promises the tolerance at every key and every half frame
+    track = bakedTrack(list(range(125)))
+    reduced = KeyTrack.reduceTrack(track, tolerance)
+    assert len(reduced) < len(track)
+    x = np.arange(0, 124.5, 0.5)
+    error = np.sqrt(((reduced.evaluate(x) - track.evaluate(x)) ** 2).sum(axis=1)).max()
+    assert error <= tolerance + 1e-9
+
+def test_reduceTrackKeepsEnds():
+    track = bakedTrack(list(range(60)))
+    reduced = KeyTrack.reduceTrack(track, 0.5)
+    assert reduced.frames[0] == 0 and reduced.frames[-1] == 59
+    assert reduced.values[0] == pytest.approx(track.values[0])
+    assert reduced.values[-1] == pytest.approx(track.values[-1])
+
+def test_reduceTrackLeavesShortTracks():
+    track = bakedTrack([0, 10])
+    assert KeyTrack.reduceTrack(track, 0.5) is track
+
+def test_trackInsertReplacesKeyOnSameFrame():
+    track = Track([KeyValue(10, 1), KeyValue(0, 0)])
+    track.insert(KeyValue(5, 5))
+    track.insert(KeyValue(10, 2))
+    assert track.frames == [0, 5, 10]
+    assert [key.value for key in track] == [0, 5, 2]
+
+def test_trackInsertManyLaterKeysWin():
+    track = Track([KeyValue(0, 0), KeyValue(5, 5)])
+    track.insertMany([KeyValue(5, 6), KeyValue(3, 3), KeyValue(5, 7)])
+    assert track.frames == [0, 3, 5]
+    assert [key.value for key in track] == [0, 3, 7]
+
+def test_trackRemoveIsInclusive():
+    track = Track([KeyValue(frame, frame) for frame in range(10)])
+    assert track.remove(2, 4) == 3
+    assert track.frames == [0, 1, 5, 6, 7, 8, 9]
+    assert track.remove(20, 30) == 0
+
+def test_trackShiftReplacesKeysItLandsOn():
+    track = Track([KeyValue(frame, frame) for frame in range(0, 10, 2)])
+    assert track.shift(2, 4, 4) == 2
+    assert track.frames == [0, 6, 8]
+    assert [key.value for key in track] == [0, 2, 4]
+    assert track.frames == sorted(track.frames)
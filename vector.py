@@ -1,6 +1,7 @@
 import math
 import random
 class Vector:
+	__slots__ = ("x", "y")
 	def __init__(self,x = 0, y = 0):
 		self.x = x
 		self.y = y
@@ -35,17 +36,37 @@ class Vector:
 		return [self.x,self.y]
 	def normal(self):
 		return Vector(self.y, -self.x)
+	def set(self, x, y):
+		self.x = x
+		self.y = y
+		return self
+	def copy(self):
+		return Vector(self.x, self.y)
 	def __add__(self,vec):
-		return Vector(self[0] + vec[0], self[1] + vec[1])
+		if type(vec) is Vector:
+			return Vector(self.x + vec.x, self.y + vec.y)
+		return Vector(self.x + vec[0], self.y + vec[1])
+	def __radd__(self, vec):
+		return self + vec
 	def __iadd__(self,vec):
-		self[0] += vec[0]
-		self[1] += vec[1]
+		if type(vec) is Vector:
+			self.x += vec.x
+			self.y += vec.y
+		else:
+			self.x += vec[0]
+			self.y += vec[1]
 		return self
 	def __sub__(self,vec):
-		return Vector(self.x - vec.x, self.y - vec.y)
+		if type(vec) is Vector:
+			return Vector(self.x - vec.x, self.y - vec.y)
+		return Vector(self.x - vec[0], self.y - vec[1])
 	def __isub__(self,vec):
-		self[0] -= vec[0]
-		self[1] -= vec[1]
+		if type(vec) is Vector:
+			self.x -= vec.x
+			self.y -= vec.y
+		else:
+			self.x -= vec[0]
+			self.y -= vec[1]
 		return self
 	def __mul__(self,mag):
 		return Vector(self.x * mag, self.y * mag)
@@ -114,17 +135,21 @@ class Vector:
 			self.y = value
 	def __len__(self):
 		return 2
+	def __iter__(self):
+		yield self.x
+		yield self.y
 	def rotate(self, angle):
-		x = self.x * math.cos(angle) - self.y * math.sin(angle)
-		y = self.x * math.sin(angle) + self.y * math.cos(angle)
-		self.x = x
-		self.y = y
+		c = math.cos(angle)
+		s = math.sin(angle)
+		self.x, self.y = self.x * c - self.y * s, self.x * s + self.y * c
 		return self
 	def integer(self):
 		self.x = int(self.x)
 		self.y = int(self.y)
 		return self
 	def __eq__(self, other):
+		if type(other) is Vector:
+			return self.x == other.x and self.y == other.y
 		return self[0] == other[0] and self[1] == other[1]
 	def __ne__(self, other):
 		return not self.__eq__(other)
@@ -149,9 +174,9 @@ def vectorFromAngle(angle, mag = 1):
 	return Vector(mag * math.cos(angle), mag * math.sin(angle))
 
 def rotateVector(vec, angle):
-	x = vec[0] * math.cos(angle) - vec[1] * math.sin(angle)
-	y = vec[0] * math.sin(angle) + vec[1] * math.cos(angle)
-	return Vector(x, y)
+	c = math.cos(angle)
+	s = math.sin(angle)
+	return Vector(vec[0] * c - vec[1] * s, vec[0] * s + vec[1] * c)
 
 def dotProduct(vec1, vec2):
 	return vec1.dot(vec2)
@@ -173,3 +198,16 @@ def vecFromTuple(tup):
 
 def tup2vec(tup):
 	return Vector(tup[0], tup[1])
+
+def transformPoints(points, angle=0, offset=(0, 0)):
+	# rotate a batch of points by angle and move them by offset, the trig is computed once for the batch
+	c = math.cos(angle)
+	s = math.sin(angle)
+	ox = offset[0]
+	oy = offset[1]
+	return [(x * c - y * s + ox, x * s + y * c + oy) for x, y in points]
+
+def translatePoints(points, offset):
+	ox = offset[0]
+	oy = offset[1]
+	return [(x + ox, y + oy) for x, y in points]